@@ -1,5 +1,7 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import plotly.express as px
 from databricks import sql
 from databricks.sdk import WorkspaceClient
@@ -8,8 +10,26 @@ import os
 import folium
 from folium.plugins import Draw
 from streamlit_folium import st_folium
-from shapely.geometry import Point, Polygon
 import json
+import threading
+import time
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from site_geometry import SELECTION_MAX_VERTICES, build_site_index, build_selection_filter, positions_mask
+from portfolio_snapshot import (
+    COMPLIANCE_LABEL_COLORS, DETAIL_COLUMNS, DETAIL_PAGE_SIZE, FILTER_OPTION_COLUMNS, SNAPSHOT_COLUMNS,
+    SORTABLE_DETAIL_COLUMNS, bitmap_row_positions, build_snapshot, cascading_filter_options, compliance_classes,
+    encode_filter_options, filter_option_label, filter_selections, format_detail_table, kpis_from_totals,
+    lookup_kpi_totals, normalize_filter_values, selection_bitmap, sort_detail_rows, sorted_page_positions,
+    summarize_leases
+)
+from site_map import (
+    DASHBOARD_MAP_ZOOM, LOD_MAX_CLUSTER_ZOOM, MAPLIBRE_ZOOM_OFFSET, build_site_lod, build_site_map,
+    build_site_map_layer, site_lod_geojson, site_map_figure, site_map_points, site_marker_style, viewport_box
+)
 
 # Page config
 st.set_page_config(
@@ -490,185 +510,1099 @@ w = WorkspaceClient()
 
 # Initialize connection with auto-reconnect
 def get_connection():
-    """Get a fresh SQL connection each time to avoid stale connections"""
+    """Open a new SQL connection (used by the pool to create warm connections)"""
     return sql.connect(
         server_hostname=cfg.host,
         http_path=f"/sql/1.0/warehouses/{os.environ.get('DATABRICKS_WAREHOUSE_ID')}",
         credentials_provider=lambda: cfg.authenticate
     )
 
-def execute_query_with_retry(query, max_retries=2):
-    """Execute a query with automatic retry on connection errors"""
-    for attempt in range(max_retries):
+# ============ SQL CONNECTION POOL ============
+# Pool sizing and health settings (override via app.yaml env)
+SQL_POOL_MIN_SIZE = int(os.environ.get("SQL_POOL_MIN_SIZE", "1"))
+SQL_POOL_MAX_SIZE = int(os.environ.get("SQL_POOL_MAX_SIZE", "8"))
+SQL_POOL_IDLE_SECONDS = float(os.environ.get("SQL_POOL_IDLE_SECONDS", "300"))
+SQL_POOL_VALIDATE_AFTER_SECONDS = float(os.environ.get("SQL_POOL_VALIDATE_AFTER_SECONDS", "30"))
+SQL_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("SQL_POOL_CHECKOUT_TIMEOUT", "30"))
+# Errors that mean the connection itself is gone (as opposed to a failing statement)
+CONNECTION_ERRORS = (sql.OperationalError, sql.InterfaceError, OSError)
+
+class PoolExhausted(Exception):
+    """No pooled connection became free within the checkout timeout"""
+
+class ConnectionPool:
+    """Thread-safe pool of warm SQL connections shared by every session"""
+
+    def __init__(self, connect, min_size=1, max_size=8, idle_seconds=300,
+                 validate_after_seconds=30, checkout_timeout=30):
+        self._connect = connect
+        self.min_size = max(min_size, 0)
+        self.max_size = max(max_size, self.min_size, 1)
+        self.idle_seconds = idle_seconds
+        self.validate_after_seconds = validate_after_seconds
+        self.checkout_timeout = checkout_timeout
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._size = 0  # open connections, idle + checked out
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Check out a healthy connection, reconnecting stale ones transparently"""
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                expired = self._evict_idle_locked()
+                if self._idle or self._size < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted("Timed out waiting for a free SQL connection")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._size += 1
+        for stale in expired:
+            self._close_quietly(stale)
+
+        if conn is not None:
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._close_quietly(conn)
+        try:
+            return self._connect()
+        except Exception:
+            # Give the slot back so other callers are not starved
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def warm(self):
+        """Open connections until min_size are idle, so the first queries skip the connect"""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                return  # The warehouse may be starting; acquire() connects on demand
+            self.release(conn)
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is broken"""
+        if discard:
+            self._close_quietly(conn)
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            # The statement failed but the connection is fine
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def _evict_idle_locked(self):
+        # Drop connections idle for too long, keeping min_size warm
+        now = time.monotonic()
+        expired = []
+        while len(self._idle) > self.min_size and now - self._idle[0][1] > self.idle_seconds:
+            conn, _ = self._idle.pop(0)
+            expired.append(conn)
+            self._size -= 1
+        return expired
+
+    def _is_healthy(self, conn, last_used):
+        if not getattr(conn, "open", True):
+            return False
+        # Only ping connections that sat idle long enough for the session to expire
+        if time.monotonic() - last_used < self.validate_after_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query)
-            result = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            cursor.close()
             conn.close()
-            return result, columns
-        except Exception as e:
+        except Exception:
+            pass
+
+@st.cache_resource
+def get_connection_pool():
+    """Process-wide connection pool, built once and shared across sessions"""
+    pool = ConnectionPool(
+        get_connection,
+        min_size=SQL_POOL_MIN_SIZE,
+        max_size=SQL_POOL_MAX_SIZE,
+        idle_seconds=SQL_POOL_IDLE_SECONDS,
+        validate_after_seconds=SQL_POOL_VALIDATE_AFTER_SECONDS,
+        checkout_timeout=SQL_POOL_CHECKOUT_TIMEOUT
+    )
+    # Open the min_size warm connections off the script thread
+    threading.Thread(target=pool.warm, name="sql-pool-warm", daemon=True).start()
+    return pool
+
+def _execute_on_pool(query, fetch, max_retries=2, parameters=None, pool=None):
+    """Run a query on a pooled connection and return fetch(cursor), retrying on a fresh connection"""
+    # Background threads pass the pool in explicitly (no Streamlit script context there)
+    pool = pool or get_connection_pool()
+    for attempt in range(max_retries):
+        try:
+            with pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, parameters)
+                    return fetch(cursor)
+        except PoolExhausted:
+            raise  # Retrying would only queue again
+        except CONNECTION_ERRORS:
             if attempt < max_retries - 1:
-                continue  # Retry
-            raise e
+                continue  # Retry (the broken connection was discarded)
+            raise
 
-# Query data
-@st.cache_data(ttl=60)  # Shorter TTL to refresh data more often
-def query_data(state_filter=None, doc_type_filter=None, tenant_filter=None):
-    query = """
-    SELECT 
-        site_name,
-        state,
-        document_type,
-        tenant_name,
-        latitude,
-        longitude,
-        total_monthly_revenue,
-        lease_status,
-        days_until_expiration,
-        revenue_per_sqft,
-        insurance_liability_min_usd,
-        equipment_space_sqft,
-        compliance_status
-    FROM bricks_demo.crown_demo.synth_data
-    WHERE latitude IS NOT NULL 
-        AND longitude IS NOT NULL
-        AND lease_status = 'Active'
+def execute_query_with_retry(query, max_retries=2, parameters=None, pool=None):
+    """Execute a query with automatic retry on connection errors"""
+    def fetch_rows(cursor):
+        result = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        return result, columns
+    return _execute_on_pool(query, fetch_rows, max_retries, parameters, pool)
+
+def execute_arrow_query(query, max_retries=2, parameters=None, pool=None):
+    """Execute a query and fetch the result as an Arrow table (no per-row Python objects)"""
+    return _execute_on_pool(query, lambda cursor: cursor.fetchall_arrow(), max_retries, parameters, pool)
+
+def arrow_to_pandas(table):
+    """Convert an Arrow result to pandas, casting DECIMAL columns to float64 up front"""
+    schema = pa.schema([
+        pa.field(field.name, pa.float64()) if pa.types.is_decimal(field.type) else field
+        for field in table.schema
+    ])
+    return table.cast(schema).to_pandas()
+
+# ============ PARAMETERIZED QUERY BUILDER ============
+# Columns the dashboard may filter on (names are inlined into SQL, values never are)
+FILTER_COLUMNS = ("site_name", "state", "document_type", "tenant_name", "compliance_status")
+
+def build_filter_clause(filters):
+    """Build AND-ed filter conditions with bound named parameters.
+
+    The SQL text only depends on which columns are filtered and how many values
+    each has, so the warehouse can reuse cached plans and results across users.
+    """
+    conditions = []
+    parameters = {}
+    for column, value in filters.items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Unsupported filter column: {column}")
+        values = normalize_filter_values(value)
+        if not values:
+            continue
+        if len(values) == 1:
+            conditions.append(f"{column} = :{column}")
+            parameters[column] = values[0]
+        else:
+            names = [f"{column}_{i}" for i in range(len(values))]
+            conditions.append(f"{column} IN ({', '.join(':' + name for name in names)})")
+            parameters.update(zip(names, values))
+    clause = "".join(f"\n        AND {condition}" for condition in conditions)
+    return clause, parameters
+
+# ============ BACKGROUND REFRESH ============
+# Loaders are refreshed ahead of time on a daemon thread; readers never wait on a refill.
+# With a version probe, data is only reloaded when the Delta table version moves.
+DATA_REFRESH_SECONDS = float(os.environ.get("DATA_REFRESH_SECONDS", "60"))
+VERSION_PROBE_SECONDS = float(os.environ.get("VERSION_PROBE_SECONDS", "10"))
+REFRESH_MAX_BACKOFF_STEPS = 6  # failed refreshes double the wait, up to 2**6 times the normal one
+
+class BackgroundRefresher:
+    """Serve the last good result of a loader and reload it in the background.
+
+    loader(version, previous) builds a new value (previous is the value being
+    replaced, or None, so loaders can refresh incrementally). Without a version_probe it is re-run every
+    `interval` seconds; with one, the probe runs every `probe_interval` seconds and
+    the loader only runs when the reported version differs from the loaded one
+    (falling back to `interval` while the probe is failing). An `initial`
+    (value, version, loaded_at) seed is served as stale and revalidated at once.
     """
 
-    if state_filter and state_filter != "All":
-        query += f" AND state = '{state_filter}'"
-    if doc_type_filter and doc_type_filter != "All":
-        query += f" AND document_type = '{doc_type_filter}'"
-    if tenant_filter and tenant_filter != "All":
-        query += f" AND tenant_name = '{tenant_filter}'"
+    def __init__(self, name, loader, interval, version_probe=None, probe_interval=None, initial=None):
+        self.name = name
+        self.interval = interval
+        self.probe_interval = probe_interval or interval
+        self.last_error = None
+        # Last time the loaded data was confirmed current (a seed was, when it was saved)
+        self.validated_at = initial[2] if initial is not None else None
+        self._loader = loader
+        self._version_probe = version_probe
+        self._current = initial  # (value, version, loaded_at), swapped as a single reference
+        self.stale = initial is not None  # serving a seed that has not been revalidated yet
+        self._load_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get(self):
+        """Return the current value; only the very first load runs in the caller"""
+        current = self._current
+        if current is None:
+            with self._load_lock:
+                if self._current is None:
+                    version = self._probe_version()
+                    self._swap(self._loader(version, None), version)
+            current = self._current
+        self._ensure_thread()
+        return current[0]
+
+    @property
+    def version(self):
+        current = self._current
+        return current[1] if current else None
+
+    @property
+    def loaded_at(self):
+        current = self._current
+        return current[2] if current else None
+
+    def refresh_soon(self):
+        """Wake the refresh thread early and force a reload"""
+        self._wake.set()
+
+    def stop(self):
+        """Stop the refresh thread; the current value stays readable"""
+        self._stop.set()
+        self._wake.set()
+
+    def _probe_version(self):
+        if self._version_probe is None:
+            return None
+        try:
+            return self._version_probe()
+        except Exception as e:
+            self.last_error = e
+            return None
+
+    def _swap(self, value, version):
+        now = time.time()
+        self._current = (value, version, now)
+        self.validated_at = now
+        self.stale = False
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._load_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=f"refresh-{self.name}", daemon=True)
+                    self._thread.refresher = self  # found again by stop_refreshers after a cache clear
+                    self._thread.start()
+
+    def _run(self):
+        wait = self.probe_interval if self._version_probe else self.interval
+        # A stale seed is revalidated immediately (once) instead of after a full interval
+        delay = 0 if self.stale else wait
+        failures = 0
+        while not self._stop.is_set():
+            forced = self._wake.wait(delay)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._refresh(forced)
+            except Exception as e:
+                # Keep serving the last good copy; try again later
+                self.last_error = e
+            # Back off while refreshes fail, so a warehouse that is down is not hammered
+            failures = min(failures + 1, REFRESH_MAX_BACKOFF_STEPS) if self.last_error is not None else 0
+            delay = wait * 2 ** failures
+
+    def _refresh(self, forced):
+        previous = self._current[0] if self._current else None
+        if self._version_probe is None:
+            self._swap(self._loader(None, previous), None)
+            self.last_error = None
+            return
 
-    result, columns = execute_query_with_retry(query)
-    return pd.DataFrame(result, columns=columns)
+        version = self._probe_version()
+        if version is None:
+            # Probe unavailable: fall back to plain interval reloads
+            if forced or time.time() - self.loaded_at >= self.interval:
+                self._swap(self._loader(None, previous), None)
+                # The data is current again even though the probe is not
+                self.last_error = None
+            return
+        if forced or version != self.version:
+            self._swap(self._loader(version, previous), version)
+        else:
+            self.validated_at = time.time()
+            self.stale = False
+        self.last_error = None
 
-# Get filter options
-@st.cache_data(ttl=60)  # Shorter TTL
-def get_filter_options():
-    # States
-    result, _ = execute_query_with_retry("SELECT DISTINCT state FROM bricks_demo.crown_demo.synth_data WHERE state IS NOT NULL ORDER BY state")
-    states = ["All"] + [row[0] for row in result]
+def stop_refreshers(name):
+    """Stop the refresh threads of every earlier refresher with this name.
 
-    # Document types
-    result, _ = execute_query_with_retry("SELECT DISTINCT document_type FROM bricks_demo.crown_demo.synth_data WHERE document_type IS NOT NULL ORDER BY document_type")
-    doc_types = ["All"] + [row[0] for row in result]
+    Threads outlive st.cache_resource: after a cache clear (or a redeploy in the
+    same process) the replaced refresher would otherwise keep polling the warehouse.
+    """
+    for thread in threading.enumerate():
+        refresher = getattr(thread, "refresher", None)
+        if refresher is not None and refresher.name == name:
+            refresher.stop()
+
+def format_data_age(loaded_at):
+    """Human-readable age of a loaded dataset, e.g. '42s ago'"""
+    age = max(0, time.time() - loaded_at)
+    if age < 60:
+        return f"{age:.0f}s ago"
+    if age < 3600:
+        return f"{age / 60:.0f} min ago"
+    return f"{age / 3600:.1f} h ago"
+
+# ============ PORTFOLIO SNAPSHOT ============
+# One shared, in-memory copy of synth_data serves the dashboard and all site maps
+# (the frame and its indexes are built by portfolio_snapshot.build_snapshot)
+SYNTH_DATA_TABLE = "bricks_demo.crown_demo.synth_data"
+SITE_LOCATION_COLUMNS = ['site_name', 'latitude', 'longitude', 'state', 'tenant_name', 'total_monthly_revenue']
+
+def synth_data_source(version=None):
+    """Table reference, pinned to a Delta version when one is known"""
+    if version is None:
+        return SYNTH_DATA_TABLE
+    return f"{SYNTH_DATA_TABLE} VERSION AS OF {int(version)}"
+
+def probe_synth_data_version(pool=None):
+    """Latest Delta commit version of synth_data (a metadata-only query)"""
+    result, columns = execute_query_with_retry(f"DESCRIBE HISTORY {SYNTH_DATA_TABLE} LIMIT 1", pool=pool)
+    return int(result[0][columns.index('version')]) if result else None
+
+# Above this share of changed rows a full reload is cheaper than merging the change feed
+CDF_MAX_CHANGE_FRACTION = float(os.environ.get("CDF_MAX_CHANGE_FRACTION", "0.5"))
+# Portfolios larger than this are not pulled into the app; the dashboard pushes work down to SQL
+PUSHDOWN_ROW_THRESHOLD = int(os.environ.get("PUSHDOWN_ROW_THRESHOLD", "250000"))
+
+def build_pushdown_snapshot(row_count, version):
+    """Placeholder snapshot for portfolios served by pushdown queries instead of locally"""
+    return {
+        "pushdown": True,
+        "df": None,
+        "row_count": row_count,
+        "version": version,
+        "loaded_at": time.time()
+    }
+
+def count_located_leases(pool=None, version=None):
+    """Row count of the snapshot query (answered from Delta statistics)"""
+    query = f"""
+    SELECT COUNT(*) AS cnt
+    FROM {synth_data_source(version)}
+    WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+    """
+    result, _ = execute_query_with_retry(query, pool=pool)
+    return int(result[0][0]) if result else 0
+
+def load_portfolio_snapshot(pool=None, version=None):
+    """Load every located lease from the warehouse in one columnar fetch"""
+    query = f"""
+    SELECT {', '.join(SNAPSHOT_COLUMNS)}
+    FROM {synth_data_source(version)}
+    WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+    """
+    return build_snapshot(arrow_to_pandas(execute_arrow_query(query, pool=pool)), version)
+
+def load_snapshot_changes(pool, from_version, to_version):
+    """Rows inserted, updated or deleted between two versions, from the Delta change data feed"""
+    query = f"""
+    SELECT {', '.join(SNAPSHOT_COLUMNS)}, _change_type, _commit_version
+    FROM table_changes('{SYNTH_DATA_TABLE}', {int(from_version)}, {int(to_version)})
+    WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+    ORDER BY _commit_version
+    """
+    return arrow_to_pandas(execute_arrow_query(query, pool=pool))
+
+def multiset_anti_join(left, right):
+    """Mask of `left` rows kept after removing one identical row per `right` row, and the match count"""
+    # Number duplicates so each right row matches exactly one left row
+    left = left[SNAPSHOT_COLUMNS].assign(_occurrence=left.groupby(SNAPSHOT_COLUMNS, dropna=False, observed=True).cumcount())
+    right = right[SNAPSHOT_COLUMNS].assign(_occurrence=right.groupby(SNAPSHOT_COLUMNS, dropna=False, observed=True).cumcount())
+    merged = left.merge(right, on=SNAPSHOT_COLUMNS + ['_occurrence'], how='left', indicator=True)
+    keep = (merged['_merge'] == 'left_only').to_numpy()
+    return keep, int(len(keep) - keep.sum())
+
+def apply_snapshot_changes(df, changes):
+    """Merge change-feed rows into a copy of the snapshot frame.
+
+    All commits are netted first: the snapshot loses one identical row per delete or
+    update pre-image (a multiset anti-join, so no primary key is needed) and gains the
+    inserts and post-images, minus rows both added and removed within the range. Only
+    snapshot rows sharing a site_name with a removed row take part in the join.
+    Raises ValueError if a removed row is not in the snapshot.
+    """
+    removed = changes.loc[changes['_change_type'].isin(['delete', 'update_preimage']), SNAPSHOT_COLUMNS]
+    added = changes.loc[changes['_change_type'].isin(['insert', 'update_postimage']), SNAPSHOT_COLUMNS]
+    if not removed.empty and not added.empty:
+        # A row inserted (or updated) and removed again inside the range cancels out
+        keep_added, _ = multiset_anti_join(added, removed)
+        keep_removed, _ = multiset_anti_join(removed, added)
+        added, removed = added[keep_added], removed[keep_removed]
+
+    keep = np.ones(len(df), dtype=bool)
+    if not removed.empty:
+        candidates = np.flatnonzero(df['site_name'].isin(removed['site_name']).to_numpy())
+        keep_candidates, matched = multiset_anti_join(df.take(candidates), removed)
+        if matched != len(removed):
+            raise ValueError("Change feed does not line up with the loaded snapshot")
+        keep[candidates[~keep_candidates]] = False
+
+    df = pd.concat([df.loc[keep, SNAPSHOT_COLUMNS], added], ignore_index=True)
+    # Categories may differ from the previous snapshot's; build_snapshot re-encodes
+    return df[SNAPSHOT_COLUMNS].reset_index(drop=True)
+
+def refresh_portfolio_snapshot(pool=None, version=None, previous=None):
+    """Bring the snapshot to `version`, reading only the change feed when possible"""
+    if (previous is not None and not previous["pushdown"] and version is not None
+            and previous["version"] is not None and version > previous["version"]):
+        try:
+            changes = load_snapshot_changes(pool, previous["version"] + 1, version)
+            if len(changes) <= CDF_MAX_CHANGE_FRACTION * max(len(previous["df"]), 1):
+                df = apply_snapshot_changes(previous["df"], changes)
+                if len(df) > PUSHDOWN_ROW_THRESHOLD:
+                    return build_pushdown_snapshot(len(df), version)
+                return build_snapshot(df, version)
+        except Exception:
+            pass  # Change data feed disabled, history vacuumed, or rows did not line up
+
+    row_count = count_located_leases(pool, version)
+    if row_count > PUSHDOWN_ROW_THRESHOLD:
+        return build_pushdown_snapshot(row_count, version)
+    return load_portfolio_snapshot(pool, version)
+
+# ============ ON-DISK SNAPSHOT ============
+# The latest snapshot is persisted as an Arrow IPC file so a fresh process can serve
+# the dashboard immediately (marked stale) while the warehouse is revalidated. It goes to the
+# system temp dir by default, since the app source dir may be read-only or shared.
+SNAPSHOT_CACHE_PATH = os.environ.get(
+    "SNAPSHOT_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "crown_lease_snapshot", "portfolio_snapshot.arrow")
+)
+SNAPSHOT_CACHE_METADATA_KEY = b"crown_snapshot"
+
+def save_snapshot_to_disk(snapshot, path=SNAPSHOT_CACHE_PATH):
+    """Atomically write the snapshot frame and its source version to an Arrow IPC file"""
+    table = pa.Table.from_pandas(snapshot["df"], preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOT_CACHE_METADATA_KEY] = json.dumps({
+        "version": snapshot["version"],
+        "loaded_at": snapshot["loaded_at"]
+    }).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def load_snapshot_from_disk(path=SNAPSHOT_CACHE_PATH):
+    """Memory-map a persisted snapshot, or return None if there is no usable file"""
+    try:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[SNAPSHOT_CACHE_METADATA_KEY])
+            if not set(SNAPSHOT_COLUMNS).issubset(table.column_names):
+                return None  # Written by an older layout
+            snapshot = build_snapshot(table.to_pandas(), meta["version"])
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+    snapshot["loaded_at"] = meta["loaded_at"]
+    return snapshot
+
+def refresh_and_persist_snapshot(pool=None, version=None, previous=None):
+    """Refresh the snapshot and keep the on-disk copy in step with it"""
+    snapshot = refresh_portfolio_snapshot(pool, version, previous)
+    if snapshot["pushdown"]:
+        return snapshot  # Nothing local to persist
+    try:
+        save_snapshot_to_disk(snapshot)
+    except OSError:
+        pass  # Read-only or full disk: only warm starts are affected
+    return snapshot
+
+@st.cache_resource
+def get_snapshot_refresher():
+    """Background refresher owning the process-wide portfolio snapshot"""
+    pool = get_connection_pool()
+    cached = load_snapshot_from_disk()
+    stop_refreshers("portfolio-snapshot")  # a refresher left behind by a cleared cache
+    return BackgroundRefresher(
+        "portfolio-snapshot",
+        lambda version, previous: refresh_and_persist_snapshot(pool, version, previous),
+        DATA_REFRESH_SECONDS,
+        version_probe=lambda: probe_synth_data_version(pool),
+        probe_interval=VERSION_PROBE_SECONDS,
+        initial=(cached, cached["version"], cached["loaded_at"]) if cached else None
+    )
 
-    # Tenants
-    result, _ = execute_query_with_retry("SELECT DISTINCT tenant_name FROM bricks_demo.crown_demo.synth_data WHERE tenant_name IS NOT NULL ORDER BY tenant_name")
-    tenants = ["All"] + [row[0] for row in result]
+def get_portfolio_snapshot():
+    """Process-wide snapshot shared by every session (treat as read-only)"""
+    return get_snapshot_refresher().get()
 
-    return states, doc_types, tenants
+# Query data
+def query_data(state_filter=None, doc_type_filter=None, tenant_filter=None, compliance_filter=None):
+    """Active leases matching the filters, served locally from the shared snapshot"""
+    snapshot = get_portfolio_snapshot()
+    bitmap = selection_bitmap(snapshot["index"], filter_selections(state_filter, doc_type_filter, tenant_filter, compliance_filter))
+    return snapshot["df"].take(bitmap_row_positions(snapshot["index"], bitmap)).reset_index(drop=True)
+
+def query_detail_page(state_filter=None, doc_type_filter=None, tenant_filter=None, compliance_filter=None,
+                      sort_column=SORTABLE_DETAIL_COLUMNS[0], descending=True, page=0):
+    """One detail-table page of the filtered active leases, cut from the pre-sorted order"""
+    snapshot = get_portfolio_snapshot()
+    bitmap = selection_bitmap(snapshot["index"], filter_selections(state_filter, doc_type_filter, tenant_filter, compliance_filter))
+    positions = sorted_page_positions(snapshot["index"], snapshot["sort_orders"][sort_column], bitmap, descending, page)
+    return snapshot["df"].take(positions).reset_index(drop=True)
+
+# Get filter options
+def get_filter_options(selections=None):
+    """Filter options with lease counts; locally they cascade from the other selections"""
+    snapshot = get_portfolio_snapshot()
+    if snapshot["pushdown"]:
+        return query_filter_options_pushdown(snapshot_cache_key(snapshot))
+    return cascading_filter_options(snapshot["index"], selections or {})
 
 # Get site locations for Genie map
-@st.cache_data(ttl=60)  # Shorter TTL
 def get_site_locations():
-    """Fetch all site locations for displaying on the Genie map"""
-    query = """
+    """All site locations for the Genie/MAS maps, projected from the shared snapshot"""
+    snapshot = get_portfolio_snapshot()
+    if snapshot["pushdown"]:
+        return query_site_locations_pushdown(snapshot_cache_key(snapshot))
+    return snapshot["df"][SITE_LOCATION_COLUMNS]
+
+# ============ AGGREGATION PUSHDOWN ============
+# Used instead of the local snapshot when the portfolio exceeds PUSHDOWN_ROW_THRESHOLD:
+# KPIs are aggregated in SQL, and only one table page and a slim map projection are fetched.
+# Results are cached per (filters, snapshot): the key holds the snapshot's load time as well as
+# its table version, so they are refetched on every reload even when the version is unknown.
+MAP_POINT_COLUMNS = ['site_name', 'latitude', 'longitude', 'total_monthly_revenue']
+
+def _pushdown_where(state_filter, doc_type_filter, tenant_filter, compliance_filter=None, site_name=None):
+    filter_clause, parameters = build_filter_clause({
+        "state": state_filter,
+        "document_type": doc_type_filter,
+        "tenant_name": tenant_filter,
+        "compliance_status": compliance_filter,
+        "site_name": site_name
+    })
+    where = f"""WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+        AND lease_status = 'Active'{filter_clause}"""
+    return where, parameters
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def query_kpi_totals_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, site_name, snapshot_key):
+    """KPI totals computed in the warehouse (same measures as the local cube)"""
+    where, parameters = _pushdown_where(state_filter, doc_type_filter, tenant_filter, compliance_filter, site_name)
+    query = f"""
+    SELECT 
+        COUNT(*) AS leases,
+        COALESCE(SUM(total_monthly_revenue), 0) AS revenue,
+        COALESCE(SUM(days_until_expiration), 0) AS days_sum,
+        COUNT(days_until_expiration) AS days_count,
+        COALESCE(SUM(revenue_per_sqft), 0) AS rpsf_sum,
+        COUNT(revenue_per_sqft) AS rpsf_count,
+        COUNT_IF(lower(compliance_status) LIKE '%compliant%' AND lower(compliance_status) NOT LIKE '%non%') AS compliant
+    FROM {synth_data_source(snapshot_key[0])}
+    {where}
+    """
+    result = arrow_to_pandas(execute_arrow_query(query, parameters=parameters))
+    return result.iloc[0].to_dict()
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def query_detail_page_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, site_name, snapshot_key,
+                               sort_column=SORTABLE_DETAIL_COLUMNS[0], descending=True, page=0):
+    """One detail-table page, sorted and paged in the warehouse"""
+    # The sort column is spliced into the SQL, so it must be one of the whitelisted columns
+    if sort_column not in SORTABLE_DETAIL_COLUMNS:
+        raise ValueError(f"Unsupported sort column: {sort_column}")
+    where, parameters = _pushdown_where(state_filter, doc_type_filter, tenant_filter, compliance_filter, site_name)
+    parameters["row_limit"] = DETAIL_PAGE_SIZE
+    parameters["row_offset"] = int(page) * DETAIL_PAGE_SIZE
+    # Same total order as the local sort orders: every projected column breaks ties, and
+    # descending reverses all of them (missing tiebreak values then come first)
+    direction = 'DESC' if descending else 'ASC'
+    tiebreak = ', '.join(f"{column} {'DESC NULLS FIRST' if descending else 'ASC NULLS LAST'}" for column in SNAPSHOT_COLUMNS)
+    query = f"""
+    SELECT {', '.join(SNAPSHOT_COLUMNS)}
+    FROM {synth_data_source(snapshot_key[0])}
+    {where}
+    ORDER BY {sort_column} {direction} NULLS LAST, {tiebreak}
+    LIMIT :row_limit OFFSET :row_offset
+    """
+    return arrow_to_pandas(execute_arrow_query(query, parameters=parameters))
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def query_map_points_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, snapshot_key):
+    """Slim site projection for the dashboard map"""
+    where, parameters = _pushdown_where(state_filter, doc_type_filter, tenant_filter, compliance_filter)
+    query = f"""
+    SELECT {', '.join(MAP_POINT_COLUMNS)}
+    FROM {synth_data_source(snapshot_key[0])}
+    {where}
+    """
+    return arrow_to_pandas(execute_arrow_query(query, parameters=parameters))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def query_filter_options_pushdown(snapshot_key):
+    """All filter domains and counts in a single grouped round trip (no cascading)"""
+    query = f"""
     SELECT 
-        site_name,
-        latitude,
-        longitude,
-        state,
-        tenant_name,
-        total_monthly_revenue
-    FROM bricks_demo.crown_demo.synth_data
+        {', '.join(FILTER_OPTION_COLUMNS)},
+        GROUPING_ID({', '.join(FILTER_OPTION_COLUMNS)}) AS grouping_set,
+        COUNT_IF(lease_status = 'Active') AS leases
+    FROM {synth_data_source(snapshot_key[0])}
     WHERE latitude IS NOT NULL 
         AND longitude IS NOT NULL
+    GROUP BY GROUPING SETS ({', '.join(f'({column})' for column in FILTER_OPTION_COLUMNS)})
     """
-
-    result, columns = execute_query_with_retry(query)
-    return pd.DataFrame(result, columns=columns)
-
-def check_point_in_polygon(lat, lon, polygon_coords):
-    """Check if a point is inside a polygon using Shapely (for map highlighting)"""
-    try:
-        point = Point(lon, lat)  # Note: shapely uses (lon, lat) order
-        polygon = Polygon(polygon_coords)
-        # Use intersects to match Databricks ST_Intersects behavior (includes boundary)
-        return polygon.intersects(point)
-    except:
-        return False
-
-def count_sites_in_polygon_db(polygon_coords):
-    """Query Databricks directly to count sites in polygon using ST_Intersects"""
-    if not polygon_coords:
+    result = arrow_to_pandas(execute_arrow_query(query))
+    options = {}
+    # GROUPING_ID sets a bit for every column rolled up; the first argument is the highest bit
+    all_bits = (1 << len(FILTER_OPTION_COLUMNS)) - 1
+    for i, column in enumerate(FILTER_OPTION_COLUMNS):
+        grouping_set = all_bits & ~(1 << (len(FILTER_OPTION_COLUMNS) - 1 - i))
+        rows = result[(result['grouping_set'] == grouping_set) & result[column].notna()].sort_values(column)
+        options[column] = encode_filter_options(rows[column].tolist(), rows['leases'].to_numpy())
+    return options
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def query_site_locations_pushdown(snapshot_key):
+    """Site locations for the Genie/MAS maps when the portfolio is not held locally"""
+    query = f"""
+    SELECT {', '.join(SITE_LOCATION_COLUMNS)}
+    FROM {synth_data_source(snapshot_key[0])}
+    WHERE latitude IS NOT NULL 
+        AND longitude IS NOT NULL
+    """
+    return arrow_to_pandas(execute_arrow_query(query))
+
+# ============ SITE SPATIAL INDEX ============
+# A packed R-tree (Shapely STRtree) over the site points, built once per snapshot and shared by
+# every session. The index and its region queries live in site_geometry.py (no Streamlit, so
+# they can be tested on their own).
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_site_index(_sites, snapshot_key):
+    """Spatial index over every site location, built once per snapshot"""
+    return build_site_index(_sites)
+
+def count_sites_in_polygon_db(selection_wkt, pool=None, version=None):
+    """Query Databricks directly to count sites in a selection's WKT using ST_Intersects"""
+    if not selection_wkt:
         return 0
 
     try:
-        # Build WKT polygon string
-        wkt_coords = ", ".join([f"{coord[0]:.6f} {coord[1]:.6f}" for coord in polygon_coords])
-
-        # Ensure polygon is closed
-        first_coord = polygon_coords[0]
-        last_coord = polygon_coords[-1]
-        if first_coord[0] != last_coord[0] or first_coord[1] != last_coord[1]:
-            wkt_coords += f", {first_coord[0]:.6f} {first_coord[1]:.6f}"
-
-        wkt_polygon = f"POLYGON(({wkt_coords}))"
-
         query = f"""
         SELECT COUNT(DISTINCT site_name) as cnt
-        FROM bricks_demo.crown_demo.synth_data
+        FROM {synth_data_source(version)}
         WHERE latitude IS NOT NULL 
             AND longitude IS NOT NULL
             AND ST_Intersects(
-                ST_GeomFromWKT('{wkt_polygon}'),
+                ST_GeomFromWKT(:wkt_polygon),
                 ST_Point(longitude, latitude)
             )
         """
 
-        result, _ = execute_query_with_retry(query)
+        result, _ = execute_query_with_retry(query, parameters={"wkt_polygon": selection_wkt}, pool=pool)
         return result[0][0] if result else 0
     except Exception as e:
-        # Fall back to local calculation if DB query fails
         return -1  # Return -1 to indicate error
 
-def format_polygon_for_query(polygon_coords):
-    """Format polygon coordinates using Databricks ST geospatial functions for Genie"""
-    if not polygon_coords:
+# ============ POLYGON SITE COUNTS ============
+# Drawn-area counts are answered locally from the site snapshot's spatial index (same
+# COUNT(DISTINCT site_name) + ST_Intersects semantics as the warehouse query) and memoized by a
+# canonical polygon hash. A warehouse recount can optionally run in the background to confirm it.
+#
+# The shapes reach the warehouse and the Genie/MAS prompts as compact WKT (build_selection_filter
+# in site_geometry.py). That WKT's geometry is the one used locally too, so the count, the
+# highlight and the query always agree.
+POLYGON_COUNT_CROSS_CHECK = os.environ.get("POLYGON_COUNT_CROSS_CHECK", "false").lower() in ("1", "true", "yes")
+POLYGON_CROSS_CHECK_ENTRIES = 256
+SELECTION_FILTER_MEMO_ENTRIES = 8
+
+def canonical_ring(ring):
+    """A drawn ring's vertices independent of its start vertex, direction and sub-micro-degree jitter"""
+    # Rounded to 6 decimals (~0.1 m)
+    ring = [tuple(round(float(value), 6) for value in point[:2]) for point in ring]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring = ring[:-1]
+    if len(ring) > 2:
+        # Start at the smallest vertex and walk towards its smaller neighbour
+        start = ring.index(min(ring))
+        ring = ring[start:] + ring[:start]
+        if ring[-1] < ring[1]:
+            ring = [ring[0]] + ring[:0:-1]
+    return ring
+
+def selection_key(shapes):
+    """Hash of a drawing set that also ignores the order the shapes were drawn in"""
+    return hashlib.sha1(json.dumps(sorted(canonical_ring(ring) for ring in shapes or [])).encode()).hexdigest()
+
+def get_selection_filter(index, shapes):
+    """Selection filter for a drawing set, memoized per session by its drawing-set hash"""
+    memo = st.session_state.setdefault("selection_filter_memo", {})
+    shapes_key = selection_key(shapes)
+    # Re-inserted below as the most recently used entry
+    entry = memo.pop(shapes_key, None)
+    if entry is None or entry[0] is not index:
+        entry = (index, build_selection_filter(index, shapes))
+    memo[shapes_key] = entry
+    while len(memo) > SELECTION_FILTER_MEMO_ENTRIES:
+        memo.pop(next(iter(memo)))
+    return entry[1]
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def count_sites_in_polygon_local(_sites, _positions, snapshot_key, shapes_key):
+    """Distinct sites among a selection's row positions"""
+    return int(_sites['site_name'].take(_positions).nunique())
+
+def count_sites_in_polygon(sites, index, snapshot_key, shapes):
+    """Memoized local site count for a drawing set (never waits on the warehouse)"""
+    selection = get_selection_filter(index, shapes)
+    if selection is None:
+        return 0
+    return count_sites_in_polygon_local(sites, selection["positions"], snapshot_key, selection_key(shapes))
+
+@st.cache_resource
+def get_polygon_cross_checks():
+    """Background warehouse recounts of drawing sets, keyed by (snapshot, drawing set)"""
+    return {
+        "executor": ThreadPoolExecutor(max_workers=2, thread_name_prefix="polygon-cross-check"),
+        "futures": {},
+        "lock": threading.Lock()
+    }
+
+def polygon_cross_check_caption(selection_wkt, snapshot, local_count):
+    """Status of the warehouse recount for a selection, starting it on first request"""
+    checks = get_polygon_cross_checks()
+    key = (snapshot_cache_key(snapshot), selection_wkt)
+    with checks["lock"]:
+        future = checks["futures"].get(key)
+        if future is None:
+            # Pinned to the snapshot's table version, so both counts see the same rows
+            future = checks["executor"].submit(count_sites_in_polygon_db, selection_wkt,
+                                               get_connection_pool(), snapshot["version"])
+            checks["futures"][key] = future
+            while len(checks["futures"]) > POLYGON_CROSS_CHECK_ENTRIES:
+                checks["futures"].pop(next(iter(checks["futures"])))
+    if not future.done():
+        return "⏳ Cross-checking the count with the warehouse…"
+    db_count = future.result()
+    if db_count == -1:
+        return "⚠️ Warehouse cross-check failed"
+    if db_count == local_count:
+        return "✔️ Matches the warehouse count"
+    return f"⚠️ The warehouse counts {db_count:,} sites"
+
+def format_polygon_for_query(selection_wkt):
+    """Format a selection's WKT as a Databricks ST filter for Genie"""
+    if not selection_wkt:
         return ""
 
-    # Build WKT (Well-Known Text) polygon string
-    # Folium returns coords as [longitude, latitude], WKT expects "longitude latitude"
-    wkt_coords = ", ".join([f"{coord[0]:.6f} {coord[1]:.6f}" for coord in polygon_coords])
+    # One short instruction with the WKT once: every Genie/MAS prompt carries it
+    return f"""
+[GEOGRAPHIC FILTER] Only include sites inside the area(s) the user drew on the map. Add this filter \
+(ST_Intersects keeps sites on the boundary; ST_Point takes longitude first):
+```sql
+WHERE ST_Intersects(ST_GeomFromWKT('{selection_wkt}'), ST_Point(longitude, latitude))
+```
+"""
+
+# ============ MAP LEVEL OF DETAIL ============
+# Clusters per zoom level are built in site_map.py; here they are cached per snapshot and
+# drawn on the folium maps at the zoom and viewport each map last reported.
+def snapshot_cache_key(snapshot):
+    """Identifies one loaded snapshot (the version alone is None for unversioned loads)"""
+    return (snapshot["version"], snapshot["loaded_at"])
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_site_location_lod(_sites, snapshot_key):
+    """LOD clusters over every site location, built once per snapshot"""
+    return build_site_lod(_sites)
+
+def folium_view(map_key, default_center, default_zoom):
+    """Zoom, centre and padded viewport box a folium map last reported (from its widget state)"""
+    state = st.session_state.get(map_key) or {}
+    zoom = state.get("zoom") or default_zoom
+    center = state.get("center")
+    center = [center["lat"], center["lng"]] if center else default_center
+    bounds = state.get("bounds") or {}
+    south_west, north_east = bounds.get("_southWest"), bounds.get("_northEast")
+    box = None
+    if south_west and north_east and None not in (south_west.get("lat"), north_east.get("lat")):
+        box = viewport_box(south_west["lat"], south_west["lng"], north_east["lat"], north_east["lng"])
+    return zoom, center, box
+
+def site_lod_layer(site_geojson):
+    """One GeoJSON layer holding every cluster and site marker of a folium view (from site_lod_geojson)"""
+    layer = folium.FeatureGroup(name="Sites")
+    folium.GeoJson(
+        site_geojson,
+        marker=folium.CircleMarker(),
+        style_function=site_marker_style,
+        popup=folium.GeoJsonPopup(fields=["name", "detail", "revenue"], labels=False, max_width=250)
+    ).add_to(layer)
+    return layer
+
+# ============ REGION SELECTION MAP ============
+# The draw-to-select map shared by the Genie and Multi-Agent tabs. The map centre and the spatial
+# structures are cached once per snapshot for every tab and session; each tab keeps only its
+# selection in session state (keys prefixed per tab) and rebuilds the site overlay when the
+# view or the drawing changes. The folium map itself is rebuilt on every render (tiles and the
+# draw control only, a few ms): st_folium adds the site overlay to the map it is given, so a
+# map shared between sessions would be mutated by each render.
+REGION_MAP_ZOOM = 4
+REGION_MAP_HEIGHT_PX = 400
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_region_map_center(_sites, snapshot_key):
+    """Initial centre of the region-selection maps, computed once per snapshot"""
+    if not _sites.empty:
+        return [float(_sites['latitude'].mean()), float(_sites['longitude'].mean())]
+    return [39.8283, -98.5795]  # Center of US
+
+def build_region_base_map(center):
+    """Fresh base folium map (tiles + drawing tools) for one region-map render"""
+    m = folium.Map(
+        location=center,
+        zoom_start=REGION_MAP_ZOOM,
+        tiles='OpenStreetMap'
+    )
 
-    # Ensure polygon is closed (first point = last point)
-    first_coord = polygon_coords[0]
-    last_coord = polygon_coords[-1]
-    if first_coord[0] != last_coord[0] or first_coord[1] != last_coord[1]:
-        wkt_coords += f", {first_coord[0]:.6f} {first_coord[1]:.6f}"
+    # Add Draw plugin for polygon drawing
+    draw = Draw(
+        export=False,
+        position='topleft',
+        draw_options={
+            'polyline': False,
+            'rectangle': True,
+            'polygon': True,
+            'circle': False,
+            'marker': False,
+            'circlemarker': False,
+        },
+        edit_options={
+            'edit': True,
+            'remove': True
+        }
+    )
+    draw.add_to(m)
+    return m
+
+def sites_in_selection_mask(index, shapes):
+    """Per-site flags for a drawing set, used to colour the markers"""
+    # The selection filter is memoized per drawing set, so each drawing queries the index once
+    selection = get_selection_filter(index, shapes)
+    return positions_mask(index["size"], selection["positions"] if selection else [])
+
+def region_site_geojson(state_prefix, sites_df, snapshot_key, zoom, box):
+    """Site overlay for a region map's view, rebuilt only when the view or the drawing changes"""
+    shapes = st.session_state[f"{state_prefix}drawn_shapes"]
+    key = (snapshot_key, zoom, box, selection_key(shapes) if shapes else None)
+    memo = st.session_state.get(f"{state_prefix}site_layer_memo")
+    if memo is None or memo[0] != key:
+        lod = get_site_location_lod(sites_df, snapshot_key)
+        highlight = None
+        if shapes:
+            highlight = sites_in_selection_mask(get_site_index(sites_df, snapshot_key), shapes)
+        memo = (key, site_lod_geojson(lod, sites_df, zoom, box, highlight))
+        st.session_state[f"{state_prefix}site_layer_memo"] = memo
+    return memo[1]
+
+def apply_region_drawings(map_key, state_prefix, sites_df, snapshot_key):
+    """Update a region map's selection from the shapes drawn on it, and its count from the snapshot"""
+    drawings = (st.session_state.get(map_key) or {}).get("all_drawings")
+    drawings_key = hashlib.sha1(json.dumps(drawings, sort_keys=True).encode()).hexdigest() if drawings is not None else None
+    # The widget keeps reporting the same drawings on every rerun; only a change is applied, so
+    # "Clear Selection" is not undone by the shape still on the map
+    if drawings_key is not None and drawings_key != st.session_state.get(f"{state_prefix}drawings_key"):
+        st.session_state[f"{state_prefix}drawings_key"] = drawings_key
+        # Every polygon and rectangle on the map is part of the selection (outer rings; the tools draw no holes).
+        # Folium returns [lon, lat], keep as is for shapely
+        shapes = [drawing["geometry"]["coordinates"][0] for drawing in drawings
+                  if drawing.get("geometry", {}).get("type") in ["Polygon", "Rectangle"]]
+        st.session_state[f"{state_prefix}drawn_shapes"] = shapes or None
+
+    # The WKT and count follow the selection and the snapshot (a background refresh moves sites)
+    shapes = st.session_state[f"{state_prefix}drawn_shapes"]
+    selection_state = (snapshot_key, selection_key(shapes) if shapes else None)
+    if selection_state == st.session_state.get(f"{state_prefix}selection_state"):
+        return
+    site_index = get_site_index(sites_df, snapshot_key)
+    selection = get_selection_filter(site_index, shapes) if shapes else None
+    if selection is None:
+        shapes = None  # nothing drawn, or only degenerate shapes (no area)
+        selection_state = (snapshot_key, None)
+    st.session_state[f"{state_prefix}selection_state"] = selection_state
+    st.session_state[f"{state_prefix}drawn_shapes"] = shapes
+    # The compact WKT sent with Genie/MAS prompts, and how many sites the vertex cap moved
+    st.session_state[f"{state_prefix}selection_wkt"] = selection["wkt"] if selection else None
+    st.session_state[f"{state_prefix}selection_changed"] = selection["changed"] if selection else 0
+
+    # Count sites locally (same semantics as the warehouse's ST_Intersects query),
+    # memoized per drawing set, so drawing never waits on a warehouse round trip
+    count = 0
+    if shapes and not sites_df.empty:
+        count = count_sites_in_polygon(sites_df, site_index, snapshot_key, shapes)
+    st.session_state[f"{state_prefix}sites_in_polygon"] = count
+
+def show_region_selection_map(map_key, state_prefix, unavailable_message):
+    """Draw-to-select map with its status panel; returns the panel column for extra content"""
+    if f"{state_prefix}drawn_shapes" not in st.session_state:
+        st.session_state[f"{state_prefix}drawn_shapes"] = None
+    if f"{state_prefix}selection_wkt" not in st.session_state:
+        st.session_state[f"{state_prefix}selection_wkt"] = None
+    if f"{state_prefix}sites_in_polygon" not in st.session_state:
+        st.session_state[f"{state_prefix}sites_in_polygon"] = 0
+    if f"{state_prefix}selection_changed" not in st.session_state:
+        st.session_state[f"{state_prefix}selection_changed"] = 0
 
-    wkt_polygon = f"POLYGON(({wkt_coords}))"
+    st.markdown("""
+    <div style="margin-bottom: 0.5rem;">
+        <h3 style="color: #1a1a1a; margin: 0; font-size: 1.1rem;">🗺️ Draw a Region to Query</h3>
+        <p style="color: #666; margin: 0.25rem 0 0 0; font-size: 0.85rem;">
+            Draw a polygon on the map to select sites, then ask questions about sites in that area.
+        </p>
+    </div>
+    """, unsafe_allow_html=True)
 
-    # Build the ST_Intersects filter clause (includes points on boundary, unlike ST_Contains)
-    st_filter = f"""ST_Intersects(
-    ST_GeomFromWKT('{wkt_polygon}'),
-    ST_Point(longitude, latitude)
-)"""
+    # Create two columns - map and info panel
+    map_col, info_col = st.columns([3, 1])
 
-    return f"""
-[GEOGRAPHIC FILTER ACTIVE - USE DATABRICKS ST FUNCTIONS]
-The user has drawn a polygon on the map. You MUST filter results to only include sites within this polygon.
+    with map_col:
+        try:
+            sites_df = get_site_locations()
+            snapshot_key = snapshot_cache_key(get_portfolio_snapshot())
+            default_center = get_region_map_center(sites_df, snapshot_key)
 
-Use this exact WHERE clause filter:
-```sql
-WHERE {st_filter}
-```
+            # Apply a new drawing before rendering, so the overlay already shows it on this rerun
+            apply_region_drawings(map_key, state_prefix, sites_df, snapshot_key)
 
-The polygon WKT: {wkt_polygon}
+            # Site markers at the level of detail for the current view: clusters when zoomed out,
+            # individual sites when zoomed in. They are a separate layer, so the base map (and
+            # the shapes drawn on it) is not re-rendered when the view changes.
+            zoom, center, box = folium_view(map_key, default_center, REGION_MAP_ZOOM)
+            site_layer = None
+            if not sites_df.empty:
+                site_layer = site_lod_layer(region_site_geojson(state_prefix, sites_df, snapshot_key, zoom, box))
 
-IMPORTANT: 
-- Use ST_Intersects (not ST_Contains) to include points on the polygon boundary
-- ST_GeomFromWKT creates the polygon geometry from WKT format
-- ST_Point(longitude, latitude) creates a point - longitude is first, latitude is second
-- Include this filter in your SQL query to get only sites within the drawn polygon
-"""
+            # Render the map and capture drawn shapes and the view (zoom/bounds drive the detail level)
+            st_folium(
+                build_region_base_map(default_center),
+                height=REGION_MAP_HEIGHT_PX,
+                width=None,
+                center=center,
+                zoom=zoom,
+                feature_group_to_add=site_layer,
+                returned_objects=["all_drawings", "zoom", "bounds", "center"],
+                key=map_key
+            )
+
+        except Exception as e:
+            st.warning(f"Could not load map: {str(e)}")
+            st.info(unavailable_message)
+
+    with info_col:
+        st.markdown("""
+        <div style="background: #f8f9fa; border-radius: 8px; padding: 1rem; height: 100%;">
+            <h4 style="color: #1a1a1a; margin: 0 0 0.75rem 0; font-size: 0.95rem;">📌 How to Use</h4>
+            <ol style="color: #666; font-size: 0.8rem; padding-left: 1.2rem; margin: 0;">
+                <li style="margin-bottom: 0.5rem;">Click the polygon 🔷 or rectangle ⬜ tool on the map</li>
+                <li style="margin-bottom: 0.5rem;">Draw a shape around the area you want to query</li>
+                <li style="margin-bottom: 0.5rem;">Ask a question about sites in that area</li>
+            </ol>
+        </div>
+        """, unsafe_allow_html=True)
+
+        st.markdown("<div style='height: 0.5rem;'></div>", unsafe_allow_html=True)
+
+        # Show polygon status
+        shapes = st.session_state[f"{state_prefix}drawn_shapes"]
+        site_count = st.session_state[f"{state_prefix}sites_in_polygon"]
+        if shapes:
+            st.success(f"✅ **{site_count}** sites selected")
+            changed = st.session_state[f"{state_prefix}selection_changed"]
+            if changed:
+                # The vertex cap had to move the boundary past some sites; the count above is the query's
+                st.caption(f"⚠️ Simplified to at most {SELECTION_MAX_VERTICES} vertices for the query: "
+                           f"{changed:,} site(s) near the edge differ from the drawn shape")
+            if POLYGON_COUNT_CROSS_CHECK:
+                st.caption(polygon_cross_check_caption(st.session_state[f"{state_prefix}selection_wkt"],
+                                                       get_portfolio_snapshot(), site_count))
+            st.button("🗑️ Clear Selection", key=f"clear_{state_prefix}polygon", on_click=set_session_state,
+                      kwargs={f"{state_prefix}drawn_shapes": None, f"{state_prefix}selection_wkt": None,
+                              f"{state_prefix}sites_in_polygon": 0, f"{state_prefix}selection_changed": 0})
+        else:
+            st.info("No area selected")
+
+    return info_col
+
+# ============ PRESENTATION ============
+# Formatting is a column operation over the one filtered frame; only the rows actually
+# shown in the table are turned into strings. The site map's base figure is cached per
+# (filter set, snapshot, zoom level) and a selection only adds a one-point overlay trace to it, so a
+# rerun builds no traces in Python (st.plotly_chart still sends the whole figure each run).
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_site_map(_load_points, filter_key, snapshot_key):
+    """Site map data for one (filter set, snapshot); shared read-only across reruns and sessions"""
+    return build_site_map(site_map_points(_load_points()))
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def get_site_map_layer(_site_map, map_key, zoom):
+    """Base traces for one (filter set, snapshot, zoom level)"""
+    return build_site_map_layer(_site_map, zoom)
+
+def detail_table_view(row_count):
+    """Sort column, direction, zero-based page and page count from the table controls"""
+    page_count = max(1, -(-int(row_count) // DETAIL_PAGE_SIZE))
+    st.session_state.setdefault("detail_sort", SORTABLE_DETAIL_COLUMNS[0])
+    st.session_state.setdefault("detail_descending", True)
+    # Clamp before the page widget is drawn: the filters may have shrunk the selection
+    st.session_state["detail_page"] = min(max(int(st.session_state.get("detail_page", 1)), 1), page_count)
+    return (st.session_state["detail_sort"], st.session_state["detail_descending"],
+            st.session_state["detail_page"] - 1, page_count)
+
+def reset_detail_page():
+    """Jump back to the first page when the sort order changes"""
+    st.session_state["detail_page"] = 1
+
+def set_session_state(**values):
+    """on_click callback: update session state before the rerun the click triggers"""
+    for key, value in values.items():
+        st.session_state[key] = value
 
 # Main app
 def main():
@@ -696,9 +1630,9 @@ def main():
     for i, (icon, label) in enumerate(tabs):
         with cols[i]:
             btn_type = "primary" if st.session_state.active_tab == i else "secondary"
-            if st.button(f"{icon} {label}", key=f"tab_{i}", type=btn_type, use_container_width=True):
-                st.session_state.active_tab = i
-                st.rerun()
+            # The click's own rerun already renders the new tab (no second st.rerun)
+            st.button(f"{icon} {label}", key=f"tab_{i}", type=btn_type, use_container_width=True,
+                      on_click=set_session_state, kwargs={"active_tab": i})
 
     st.markdown("<br>", unsafe_allow_html=True)
 
@@ -717,52 +1651,92 @@ def show_dashboard():
 
     # Get filter options
     try:
-        states, doc_types, tenants = get_filter_options()
+        # Options cascade: each filter only offers values that intersect the other selections
+        current_selections = filter_selections(*(st.session_state.get(f"filter_{column}") for column in FILTER_OPTION_COLUMNS))
+        filter_options = get_filter_options(current_selections)
 
         # Initialize session state for site filter
         if 'selected_site' not in st.session_state:
             st.session_state.selected_site = None
 
-        # Filters in columns
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            state_filter = st.selectbox("State", states)
-        with col2:
-            doc_type_filter = st.selectbox("Document Type", doc_types)
-        with col3:
-            tenant_filter = st.selectbox("Tenant Name", tenants)
+        # Filters in columns (empty selection = All)
+        filter_labels = ["State", "Document Type", "Tenant Name", "Compliance Status"]
+        filter_values = []
+        for col, column, label in zip(st.columns(len(filter_labels)), FILTER_OPTION_COLUMNS, filter_labels):
+            with col:
+                options = filter_options[column]
+                # Keep current picks selectable even if they no longer match anything
+                choices = options["values"] + [v for v in current_selections[column] if v not in options["values"]]
+                filter_values.append(tuple(st.multiselect(
+                    label, choices, key=f"filter_{column}",
+                    format_func=filter_option_label(options), placeholder="All"
+                )))
+        state_filter, doc_type_filter, tenant_filter, compliance_filter = filter_values
+
+        # Query data: locally from the snapshot, or pushed down to SQL for large portfolios
+        snapshot = get_portfolio_snapshot()
+        leases = None if snapshot["pushdown"] else query_data(state_filter, doc_type_filter, tenant_filter, compliance_filter)
+
+        # Data age indicator (the snapshot refreshes in the background)
+        snapshot_refresher = get_snapshot_refresher()
+        age_text = f"🕒 Data loaded {format_data_age(snapshot_refresher.loaded_at)}"
+        if snapshot_refresher.version is not None:
+            age_text += f" (table version {snapshot_refresher.version}"
+            if snapshot_refresher.validated_at is not None:
+                age_text += f", checked {format_data_age(snapshot_refresher.validated_at)}"
+            age_text += ")"
+        if snapshot_refresher.stale:
+            age_text += " — cached copy from disk, revalidating in the background"
+        elif snapshot_refresher.last_error is not None:
+            age_text += " — latest refresh failed, showing last good copy"
+        st.caption(age_text)
+
+        # Everything that depends on the selected site reruns on its own (map clicks, paging)
+        show_dashboard_site_view(snapshot, (state_filter, doc_type_filter, tenant_filter, compliance_filter), leases)
 
-        # Query data with site filter
-        df = query_data(state_filter, doc_type_filter, tenant_filter)
+    except Exception as e:
+        st.error(f"Error loading dashboard: {str(e)}")
+        st.info("Please ensure the SQL Warehouse is running and you have proper access to the data.")
 
-        # Apply site filter if selected from map
+@st.fragment
+def show_dashboard_site_view(snapshot, filters, leases):
+    """Banner, KPI cards, map and table: a map click reruns only this fragment"""
+    try:
+        state_filter, doc_type_filter, tenant_filter, compliance_filter = filters
+        pushdown = snapshot["pushdown"]
+        selected_site = st.session_state.selected_site
+        if pushdown:
+            snapshot_key = snapshot_cache_key(snapshot)
+            totals = query_kpi_totals_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, selected_site, snapshot_key)
+            row_count = int(totals['leases'])
+            # A selected site's few rows back its compliance card
+            df = query_detail_page_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, selected_site, snapshot_key) if selected_site else None
+        else:
+            df = leases[leases['site_name'] == selected_site] if selected_site else leases
+            row_count = len(df)
+
+        # Site filter (selected from the map) is already applied above
         if st.session_state.selected_site:
-            df = df[df['site_name'] == st.session_state.selected_site]
             st.info(f"🎯 Showing: **{st.session_state.selected_site}** — Click the site again or 'Clear' to see all sites")
         else:
-            st.info(f"📊 Showing: **All Sites** ({len(df)} total) — Click any marker on the map to filter")
+            st.info(f"📊 Showing: **All Sites** ({row_count} total) — Click any marker on the map to filter")
 
-        if df.empty:
+        if row_count == 0:
             st.warning("No data found for the selected filters.")
             return
 
-        # Convert numeric columns to proper types
-        numeric_columns = ['total_monthly_revenue', 'revenue_per_sqft', 'days_until_expiration',
-                           'insurance_liability_min_usd', 'equipment_space_sqft']
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        # Metrics row with custom styled cards
-        total_revenue = df['total_monthly_revenue'].sum()
-        num_leases = len(df)
-        avg_days_remaining = df['days_until_expiration'].mean()
-        avg_revenue_per_sqft = df['revenue_per_sqft'].mean()
-
-        # Handle NaN values safely
-        total_revenue = 0 if pd.isna(total_revenue) else total_revenue
-        avg_days_remaining = 0 if pd.isna(avg_days_remaining) else avg_days_remaining
-        avg_revenue_per_sqft = 0 if pd.isna(avg_revenue_per_sqft) else avg_revenue_per_sqft
+        # Metrics row with custom styled cards (cube lookup, or the selected site's rows;
+        # in pushdown mode the totals were already aggregated in SQL)
+        if not pushdown:
+            if st.session_state.selected_site:
+                totals = summarize_leases(df)
+            else:
+                totals = lookup_kpi_totals(snapshot["cube"], state_filter, doc_type_filter, tenant_filter, compliance_filter)
+        kpis = kpis_from_totals(totals)
+        total_revenue = kpis['total_revenue']
+        num_leases = kpis['num_leases']
+        avg_days_remaining = kpis['avg_days_remaining']
+        avg_revenue_per_sqft = kpis['avg_revenue_per_sqft']
 
         metric1, metric2, metric3, metric4 = st.columns(4)
 
@@ -794,14 +1768,8 @@ def show_dashboard():
                 status_text = df['compliance_status'].iloc[0] if 'compliance_status' in df.columns and len(df) > 0 else "Unknown"
                 status_text = str(status_text) if pd.notna(status_text) else "Unknown"
                 
-                # Color based on status text
-                status_lower = status_text.lower()
-                if 'compliant' in status_lower and 'non' not in status_lower:
-                    compliance_color = "metric-label-green"
-                elif 'pending' in status_lower:
-                    compliance_color = "metric-label-orange"
-                else:
-                    compliance_color = "metric-label-red"
+                # Color based on the precomputed compliance class
+                compliance_color = COMPLIANCE_LABEL_COLORS[int(compliance_classes(df)[0])]
                 
                 st.markdown(f'''
                 <div class="metric-card">
@@ -811,11 +1779,7 @@ def show_dashboard():
                 ''', unsafe_allow_html=True)
             else:
                 # Multiple sites: show percentage of compliant sites
-                if 'compliance_status' in df.columns:
-                    compliant_count = len(df[df['compliance_status'].str.lower().str.contains('compliant', na=False) & ~df['compliance_status'].str.lower().str.contains('non', na=False)])
-                    compliance_rate = (compliant_count / num_leases * 100) if num_leases > 0 else 0
-                else:
-                    compliance_rate = 0
+                compliance_rate = kpis['compliance_rate']
                 
                 compliance_color = "metric-label-green" if compliance_rate >= 80 else "metric-label-orange" if compliance_rate >= 50 else "metric-label-red"
                 st.markdown(f'''
@@ -846,117 +1810,113 @@ def show_dashboard():
         </style>
         """, unsafe_allow_html=True)
 
+        # All sites for the filters stay on the map even when one is selected; the site data is
+        # built once per (filter set, snapshot) and only loads its points on a cache miss
+        if pushdown:
+            load_points = lambda: query_map_points_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, snapshot_cache_key(snapshot))
+        else:
+            load_points = lambda: leases
+        map_key = (filters, snapshot_cache_key(snapshot))
+        site_map = get_site_map(load_points, *map_key)
+
+        # Map view (zoom + centre) is per filter set; clicking a cluster drills into it
+        view = st.session_state.get("dashboard_map_view")
+        if not view or view["filters"] != filters:
+            view = {"filters": filters, "zoom": DASHBOARD_MAP_ZOOM,
+                    "center": tuple(site_map["center"].values()) if site_map["center"] else (39.8283, -98.5795)}
+            st.session_state.dashboard_map_view = view
+
         col1, col2, col3 = st.columns([0.12, 0.08, 0.80])
         with col1:
             st.markdown('<div class="section-header" style="margin: 0; white-space: nowrap;">📍 Site Locations</div>', unsafe_allow_html=True)
         with col2:
             if st.session_state.selected_site:
-                if st.button("✕ Clear", key="clear_site"):
-                    st.session_state.selected_site = None
-                    st.rerun()
-        # col3 is empty spacer
-
-        st.caption("🖱️ Click on any site marker to filter the dashboard to that site")
+                st.button("✕ Clear", key="clear_site", on_click=set_session_state, kwargs={"selected_site": None})
+        with col3:
+            if view["zoom"] != DASHBOARD_MAP_ZOOM:
+                st.button("⤢ Zoom out", key="reset_map_view", on_click=set_session_state, kwargs={"dashboard_map_view": None})
 
-        # Get unfiltered data for map (to show all sites even when one is selected)
-        df_all_sites = query_data(state_filter, doc_type_filter, tenant_filter)
+        st.caption("🖱️ Click a cluster to zoom in to finer clusters, or any site marker to filter the dashboard to that site")
 
-        # Create a copy for display and clean data
-        df_display = df_all_sites.copy()
-        df_display = df_display.dropna(subset=['total_monthly_revenue', 'latitude', 'longitude'])
+        # Highlight selected site if any
+        selected_site = st.session_state.get('selected_site', None)
 
-        if df_display.empty:
+        if not len(site_map["site_names"]):
             st.warning("No valid site location data available.")
         else:
-            # Convert to numeric for plotting
-            df_display['total_monthly_revenue'] = pd.to_numeric(df_display['total_monthly_revenue'], errors='coerce')
-            df_display['revenue_per_sqft'] = pd.to_numeric(df_display['revenue_per_sqft'], errors='coerce')
-            df_display = df_display.dropna(subset=['total_monthly_revenue'])
-
-            # Reset index to ensure proper mapping with selection
-            df_display = df_display.reset_index(drop=True)
-
-            df_display['revenue_display'] = df_display['total_monthly_revenue'].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
-
-            # Highlight selected site if any
-            selected_site = st.session_state.get('selected_site', None)
-            if selected_site:
-                df_display['marker_size'] = df_display['site_name'].apply(
-                    lambda x: 20 if x == selected_site else 10
-                )
-                df_display['marker_color'] = df_display['site_name'].apply(
-                    lambda x: '#e63946' if x == selected_site else '#2196F3'
-                )
-            else:
-                df_display['marker_size'] = [12] * len(df_display)
-                df_display['marker_color'] = ['#2196F3'] * len(df_display)
-
-            fig = px.scatter_mapbox(
-                df_display,
-                lat='latitude',
-                lon='longitude',
-                hover_name='site_name',
-                hover_data={
-                    'latitude': False,
-                    'longitude': False,
-                    'state': True,
-                    'tenant_name': True,
-                    'revenue_display': True,
-                    'revenue_per_sqft': ':.2f',
-                    'marker_size': False,
-                    'marker_color': False
-                },
-                color_discrete_sequence=['#2196F3'],
-                size='marker_size',
-                zoom=3,
-                height=500,
-                labels={'revenue_display': 'Monthly Revenue', 'revenue_per_sqft': 'Revenue/Sq Ft'}
-            )
-
-            # Update marker colors for selected site
-            if selected_site:
-                colors = df_display['marker_color'].tolist()
-                fig.update_traces(marker=dict(color=colors))
-
-            fig.update_layout(
-                mapbox_style="open-street-map",
-                margin={"r": 0, "t": 0, "l": 0, "b": 0}
-            )
-
             # Make map clickable with selection
-            event = st.plotly_chart(fig, use_container_width=True, on_select="rerun", selection_mode="points", key="map_select")
+            layer = get_site_map_layer(site_map, map_key, view["zoom"])
+            event = st.plotly_chart(site_map_figure(site_map, layer, view, selected_site), use_container_width=True,
+                                    on_select="rerun", selection_mode="points", key="map_select")
 
-            # Handle map click selection (toggle behavior)
+            # Handle map click selection: drill into clusters, toggle sites
             if event and event.selection and event.selection.points:
                 clicked_point = event.selection.points[0]
                 point_index = clicked_point.get('point_index', None)
-                if point_index is not None and point_index < len(df_display):
-                    clicked_site = df_display.iloc[point_index]['site_name']
+                curve_number = clicked_point.get('curve_number', 0)
+                clicked_site = None
+                if curve_number == 0 and point_index is not None and point_index < len(layer["clusters"]):
+                    lat, lon = layer["clusters"][point_index]
+                    st.session_state.dashboard_map_view = {
+                        "filters": filters,
+                        "zoom": min(view["zoom"] + 2, LOD_MAX_CLUSTER_ZOOM + 1 - MAPLIBRE_ZOOM_OFFSET),
+                        "center": (float(lat), float(lon))
+                    }
+                    st.rerun(scope="fragment")
+                elif curve_number == 1 and point_index is not None and point_index < len(layer["sites"]):
+                    clicked_site = site_map["site_names"][layer["sites"][point_index]]
+                elif curve_number == 2:
+                    clicked_site = selected_site  # the highlight overlay
+                if clicked_site is not None:
                     # Toggle: if clicking same site, deselect it; otherwise select new site
                     if clicked_site == st.session_state.selected_site:
                         st.session_state.selected_site = None  # Deselect
                     else:
                         st.session_state.selected_site = clicked_site  # Select new
-                    st.rerun()
+                    st.rerun(scope="fragment")
 
-        # Data table - using Pandas Styler for visibility
-        st.markdown('<div class="section-header">📋 Detailed Data</div>', unsafe_allow_html=True)
+        show_dashboard_detail_table(snapshot, filters, selected_site, df, row_count)
 
-        # Prepare data for display
-        display_df = df[[
-            'site_name', 'state', 'tenant_name', 'document_type',
-            'total_monthly_revenue', 'revenue_per_sqft',
-            'days_until_expiration', 'insurance_liability_min_usd'
-        ]].sort_values('total_monthly_revenue', ascending=False).head(50).copy()
+    except Exception as e:
+        st.error(f"Error loading dashboard: {str(e)}")
+        st.info("Please ensure the SQL Warehouse is running and you have proper access to the data.")
+
+@st.fragment
+def show_dashboard_detail_table(snapshot, filters, selected_site, site_leases, row_count):
+    """Sortable, paged detail table: sorting and paging rerun only this fragment"""
+    try:
+        state_filter, doc_type_filter, tenant_filter, compliance_filter = filters
+        sort_column, descending, page, page_count = detail_table_view(row_count)
 
-        # Format numeric columns
-        display_df['total_monthly_revenue'] = display_df['total_monthly_revenue'].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
-        display_df['revenue_per_sqft'] = display_df['revenue_per_sqft'].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
-        display_df['days_until_expiration'] = display_df['days_until_expiration'].apply(lambda x: f"{x:,.0f}" if pd.notna(x) else "N/A")
-        display_df['insurance_liability_min_usd'] = display_df['insurance_liability_min_usd'].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
+        # Data table - using Pandas Styler for visibility
+        st.markdown('<div class="section-header">📋 Detailed Data</div>', unsafe_allow_html=True)
 
-        # Rename columns for display
-        display_df.columns = ['Site Name', 'State', 'Tenant', 'Document Type', 'Monthly Revenue', 'Revenue/SqFt', 'Days Remaining', 'Insurance Liability']
+        # Sort and page controls (the page is clamped to the selection in detail_table_view)
+        sort_col, desc_col, page_col, range_col = st.columns([0.3, 0.15, 0.15, 0.4])
+        with sort_col:
+            st.selectbox("Sort by", SORTABLE_DETAIL_COLUMNS, key="detail_sort",
+                         format_func=DETAIL_COLUMNS.get, on_change=reset_detail_page)
+        with desc_col:
+            st.toggle("Descending", key="detail_descending", on_change=reset_detail_page)
+        with page_col:
+            st.number_input(f"Page (of {page_count:,})", min_value=1, max_value=page_count, step=1, key="detail_page")
+        with range_col:
+            first_row = page * DETAIL_PAGE_SIZE
+            st.caption(f"Rows {first_row + 1:,}–{min(first_row + DETAIL_PAGE_SIZE, row_count):,} of {row_count:,}")
+
+        # Only the visible page is materialized and formatted
+        if snapshot["pushdown"]:
+            page_rows = query_detail_page_pushdown(state_filter, doc_type_filter, tenant_filter, compliance_filter, selected_site,
+                                                   snapshot_cache_key(snapshot), sort_column, descending, page)
+        elif selected_site:
+            # A single site's handful of leases is simply sorted in place
+            page_rows = sort_detail_rows(site_leases, sort_column, descending)
+            page_rows = page_rows.iloc[page * DETAIL_PAGE_SIZE:(page + 1) * DETAIL_PAGE_SIZE]
+        else:
+            page_rows = query_detail_page(state_filter, doc_type_filter, tenant_filter, compliance_filter,
+                                          sort_column, descending, page)
+        display_df = format_detail_table(page_rows)
+        display_df.index = np.arange(first_row + 1, first_row + 1 + len(display_df))  # row numbers across pages
 
         # Use st.table with custom styling (simpler and more reliable)
         st.markdown("""
@@ -982,8 +1942,7 @@ def show_dashboard():
         st.table(display_df)
 
     except Exception as e:
-        st.error(f"Error loading dashboard: {str(e)}")
-        st.info("Please ensure the SQL Warehouse is running and you have proper access to the data.")
+        st.error(f"Error loading table: {str(e)}")
 
 def show_genie_space():
     # Header
@@ -1012,175 +1971,16 @@ def show_genie_space():
         """)
         return
 
-    # Initialize session state for chat history and polygon
+    # Initialize session state for chat history
     if 'genie_messages' not in st.session_state:
         st.session_state.genie_messages = []
-    if 'drawn_polygon' not in st.session_state:
-        st.session_state.drawn_polygon = None
-    if 'sites_in_polygon' not in st.session_state:
-        st.session_state.sites_in_polygon = 0
 
     # ============ INTERACTIVE MAP WITH POLYGON DRAWING ============
-    st.markdown("""
-    <div style="margin-bottom: 0.5rem;">
-        <h3 style="color: #1a1a1a; margin: 0; font-size: 1.1rem;">🗺️ Draw a Region to Query</h3>
-        <p style="color: #666; margin: 0.25rem 0 0 0; font-size: 0.85rem;">
-            Draw a polygon on the map to select sites, then ask questions about sites in that area.
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
-
-    # Create two columns - map and info panel
-    map_col, info_col = st.columns([3, 1])
-
-    with map_col:
-        try:
-            # Get site locations for the map
-            sites_df = get_site_locations()
-
-            if not sites_df.empty:
-                # Calculate map center
-                center_lat = sites_df['latitude'].astype(float).mean()
-                center_lon = sites_df['longitude'].astype(float).mean()
-            else:
-                center_lat, center_lon = 39.8283, -98.5795  # Center of US
-
-            # Create folium map
-            m = folium.Map(
-                location=[center_lat, center_lon],
-                zoom_start=4,
-                tiles='OpenStreetMap'
-            )
-
-            # Add Draw plugin for polygon drawing
-            draw = Draw(
-                export=False,
-                position='topleft',
-                draw_options={
-                    'polyline': False,
-                    'rectangle': True,
-                    'polygon': True,
-                    'circle': False,
-                    'marker': False,
-                    'circlemarker': False,
-                },
-                edit_options={
-                    'edit': True,
-                    'remove': True
-                }
-            )
-            draw.add_to(m)
-
-            # Add site markers to the map
-            if not sites_df.empty:
-                for _, row in sites_df.iterrows():
-                    try:
-                        lat = float(row['latitude'])
-                        lon = float(row['longitude'])
-                        site_name = str(row['site_name'])
-                        state = str(row.get('state', 'N/A'))
-                        revenue = row.get('total_monthly_revenue', 0)
-
-                        # Check if site is in selected polygon
-                        is_in_polygon = False
-                        if st.session_state.drawn_polygon:
-                            is_in_polygon = check_point_in_polygon(lat, lon, st.session_state.drawn_polygon)
-
-                        # Color based on selection
-                        marker_color = '#e63946' if is_in_polygon else '#2196F3'
-
-                        popup_html = f"""
-                        <div style="font-family: Arial; width: 200px;">
-                            <b>{site_name}</b><br>
-                            📍 {state}<br>
-                            💰 ${revenue:,.0f}/month
-                        </div>
-                        """
-
-                        folium.CircleMarker(
-                            location=[lat, lon],
-                            radius=6 if not is_in_polygon else 8,
-                            popup=folium.Popup(popup_html, max_width=250),
-                            color=marker_color,
-                            fill=True,
-                            fillColor=marker_color,
-                            fillOpacity=0.7,
-                            weight=2
-                        ).add_to(m)
-                    except (ValueError, TypeError):
-                        continue
-
-            # Render the map and capture drawn shapes
-            map_data = st_folium(
-                m,
-                height=400,
-                width=None,
-                returned_objects=["all_drawings"],
-                key="genie_map"
-            )
-
-            # Process drawn shapes
-            if map_data and map_data.get("all_drawings"):
-                drawings = map_data["all_drawings"]
-                if drawings:
-                    # Get the last drawn shape
-                    last_drawing = drawings[-1]
-                    if last_drawing.get("geometry", {}).get("type") in ["Polygon", "Rectangle"]:
-                        coords = last_drawing["geometry"]["coordinates"][0]
-                        # Folium returns [lon, lat], keep as is for shapely
-                        st.session_state.drawn_polygon = coords
-
-                        # Count sites in polygon using Databricks ST_Intersects (same as Genie query)
-                        count = count_sites_in_polygon_db(coords)
-                        if count == -1:
-                            # Fallback to local count if DB query failed
-                            count = 0
-                            if not sites_df.empty:
-                                for _, row in sites_df.iterrows():
-                                    try:
-                                        lat = float(row['latitude'])
-                                        lon = float(row['longitude'])
-                                        if check_point_in_polygon(lat, lon, coords):
-                                            count += 1
-                                    except:
-                                        continue
-                        st.session_state.sites_in_polygon = count
-                else:
-                    # No drawings - clear polygon if it was set
-                    if st.session_state.drawn_polygon and not drawings:
-                        st.session_state.drawn_polygon = None
-                        st.session_state.sites_in_polygon = 0
-
-        except Exception as e:
-            st.warning(f"Could not load map: {str(e)}")
-            st.info("You can still chat with Genie without the map.")
+    info_col = show_region_selection_map("genie_map", "", "You can still chat with Genie without the map.")
 
     with info_col:
-        st.markdown("""
-        <div style="background: #f8f9fa; border-radius: 8px; padding: 1rem; height: 100%;">
-            <h4 style="color: #1a1a1a; margin: 0 0 0.75rem 0; font-size: 0.95rem;">📌 How to Use</h4>
-            <ol style="color: #666; font-size: 0.8rem; padding-left: 1.2rem; margin: 0;">
-                <li style="margin-bottom: 0.5rem;">Click the polygon 🔷 or rectangle ⬜ tool on the map</li>
-                <li style="margin-bottom: 0.5rem;">Draw a shape around the area you want to query</li>
-                <li style="margin-bottom: 0.5rem;">Ask a question about sites in that area</li>
-            </ol>
-        </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown("<div style='height: 0.5rem;'></div>", unsafe_allow_html=True)
-
-        # Show polygon status
-        if st.session_state.drawn_polygon:
-            st.success(f"✅ **{st.session_state.sites_in_polygon}** sites selected")
-            if st.button("🗑️ Clear Selection", key="clear_polygon"):
-                st.session_state.drawn_polygon = None
-                st.session_state.sites_in_polygon = 0
-                st.rerun()
-        else:
-            st.info("No area selected")
-
         # Suggested queries when polygon is drawn
-        if st.session_state.drawn_polygon:
+        if st.session_state.drawn_shapes:
             st.markdown("""
             <div style="margin-top: 0.75rem;">
                 <p style="color: #666; font-size: 0.8rem; margin-bottom: 0.5rem;"><b>Try asking:</b></p>
@@ -1200,9 +2000,7 @@ def show_genie_space():
 
     # Clear chat history button (only show if there's history)
     if st.session_state.genie_messages:
-        if st.button("🗑️ Clear Chat History", key="clear_genie"):
-            st.session_state.genie_messages = []
-            st.rerun()
+        st.button("🗑️ Clear Chat History", key="clear_genie", on_click=set_session_state, kwargs={"genie_messages": []})
         st.markdown("---")
 
     # Display chat history (only completed exchanges)
@@ -1211,19 +2009,19 @@ def show_genie_space():
             st.markdown(message["content"])
 
     # Chat input
-    placeholder_text = "Ask about sites in the selected area..." if st.session_state.drawn_polygon else "Ask about your lease data..."
+    placeholder_text = "Ask about sites in the selected area..." if st.session_state.drawn_shapes else "Ask about your lease data..."
 
     if prompt := st.chat_input(placeholder_text):
         # Display user message (don't add to history yet)
         with st.chat_message("user"):
             st.markdown(prompt)
-            if st.session_state.drawn_polygon:
-                st.caption(f"🗺️ Query includes {st.session_state.sites_in_polygon} sites from selected polygon")
+            if st.session_state.drawn_shapes:
+                st.caption(f"🗺️ Query includes {st.session_state.sites_in_polygon} sites from the selected area")
 
         # Build the enhanced prompt with polygon context if available
         enhanced_prompt = prompt
-        if st.session_state.drawn_polygon:
-            polygon_context = format_polygon_for_query(st.session_state.drawn_polygon)
+        if st.session_state.drawn_shapes:
+            polygon_context = format_polygon_for_query(st.session_state.selection_wkt)
             enhanced_prompt = f"{prompt}\n\n{polygon_context}"
 
         # Get response from Genie
@@ -1346,7 +2144,7 @@ def show_genie_space():
                                                                 map_df = pd.DataFrame(map_data)
 
                                                                 # Create map
-                                                                fig = px.scatter_mapbox(
+                                                                fig = px.scatter_map(
                                                                     map_df,
                                                                     lat='latitude',
                                                                     lon='longitude',
@@ -1356,7 +2154,7 @@ def show_genie_space():
                                                                     height=400
                                                                 )
                                                                 fig.update_layout(
-                                                                    mapbox_style="open-street-map",
+                                                                    map_style="open-street-map",
                                                                     margin={"r": 0, "t": 0, "l": 0, "b": 0}
                                                                 )
                                                                 st.plotly_chart(fig, use_container_width=True)
@@ -1454,9 +2252,7 @@ def show_knowledge_assistant():
 
     # Clear chat history button (only show if there's history)
     if st.session_state.ka_messages:
-        if st.button("🗑️ Clear Chat History", key="clear_ka"):
-            st.session_state.ka_messages = []
-            st.rerun()
+        st.button("🗑️ Clear Chat History", key="clear_ka", on_click=set_session_state, kwargs={"ka_messages": []})
         st.markdown("---")
 
     # Display chat history (only completed exchanges)
@@ -1535,180 +2331,18 @@ def show_multi_agent_supervisor():
     </div>
     """, unsafe_allow_html=True)
 
-    # Initialize session state for chat history and polygon
+    # Initialize session state for chat history
     if 'mas_messages' not in st.session_state:
         st.session_state.mas_messages = []
-    if 'mas_drawn_polygon' not in st.session_state:
-        st.session_state.mas_drawn_polygon = None
-    if 'mas_sites_in_polygon' not in st.session_state:
-        st.session_state.mas_sites_in_polygon = 0
 
     # ============ INTERACTIVE MAP WITH POLYGON DRAWING ============
-    st.markdown("""
-    <div style="margin-bottom: 0.5rem;">
-        <h3 style="color: #1a1a1a; margin: 0; font-size: 1.1rem;">🗺️ Draw a Region to Query</h3>
-        <p style="color: #666; margin: 0.25rem 0 0 0; font-size: 0.85rem;">
-            Draw a polygon on the map to select sites, then ask questions about sites in that area.
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
-
-    # Create two columns - map and info panel
-    map_col, info_col = st.columns([3, 1])
-
-    with map_col:
-        try:
-            # Get site locations for the map
-            sites_df = get_site_locations()
-
-            if not sites_df.empty:
-                # Calculate map center
-                center_lat = sites_df['latitude'].astype(float).mean()
-                center_lon = sites_df['longitude'].astype(float).mean()
-            else:
-                center_lat, center_lon = 39.8283, -98.5795  # Center of US
-
-            # Create folium map
-            m = folium.Map(
-                location=[center_lat, center_lon],
-                zoom_start=4,
-                tiles='OpenStreetMap'
-            )
-
-            # Add Draw plugin for polygon drawing
-            draw = Draw(
-                export=False,
-                position='topleft',
-                draw_options={
-                    'polyline': False,
-                    'rectangle': True,
-                    'polygon': True,
-                    'circle': False,
-                    'marker': False,
-                    'circlemarker': False,
-                },
-                edit_options={
-                    'edit': True,
-                    'remove': True
-                }
-            )
-            draw.add_to(m)
-
-            # Add site markers to the map
-            if not sites_df.empty:
-                for _, row in sites_df.iterrows():
-                    try:
-                        lat = float(row['latitude'])
-                        lon = float(row['longitude'])
-                        site_name = str(row['site_name'])
-                        state = str(row.get('state', 'N/A'))
-                        revenue = row.get('total_monthly_revenue', 0)
-
-                        # Check if site is in selected polygon
-                        is_in_polygon = False
-                        if st.session_state.mas_drawn_polygon:
-                            is_in_polygon = check_point_in_polygon(lat, lon, st.session_state.mas_drawn_polygon)
-
-                        # Color based on selection
-                        marker_color = '#e63946' if is_in_polygon else '#2196F3'
-
-                        popup_html = f"""
-                        <div style="font-family: Arial; width: 200px;">
-                            <b>{site_name}</b><br>
-                            📍 {state}<br>
-                            💰 ${revenue:,.0f}/month
-                        </div>
-                        """
-
-                        folium.CircleMarker(
-                            location=[lat, lon],
-                            radius=6 if not is_in_polygon else 8,
-                            popup=folium.Popup(popup_html, max_width=250),
-                            color=marker_color,
-                            fill=True,
-                            fillColor=marker_color,
-                            fillOpacity=0.7,
-                            weight=2
-                        ).add_to(m)
-                    except (ValueError, TypeError):
-                        continue
-
-            # Render the map and capture drawn shapes
-            map_data = st_folium(
-                m,
-                height=400,
-                width=None,
-                returned_objects=["all_drawings"],
-                key="mas_map"
-            )
-
-            # Process drawn shapes
-            if map_data and map_data.get("all_drawings"):
-                drawings = map_data["all_drawings"]
-                if drawings:
-                    # Get the last drawn shape
-                    last_drawing = drawings[-1]
-                    if last_drawing.get("geometry", {}).get("type") in ["Polygon", "Rectangle"]:
-                        coords = last_drawing["geometry"]["coordinates"][0]
-                        # Folium returns [lon, lat], keep as is for shapely
-                        st.session_state.mas_drawn_polygon = coords
-
-                        # Count sites in polygon using Databricks ST_Intersects (same as query)
-                        count = count_sites_in_polygon_db(coords)
-                        if count == -1:
-                            # Fallback to local count if DB query failed
-                            count = 0
-                            if not sites_df.empty:
-                                for _, row in sites_df.iterrows():
-                                    try:
-                                        lat = float(row['latitude'])
-                                        lon = float(row['longitude'])
-                                        if check_point_in_polygon(lat, lon, coords):
-                                            count += 1
-                                    except:
-                                        continue
-                        st.session_state.mas_sites_in_polygon = count
-                else:
-                    # No drawings - clear polygon if it was set
-                    if st.session_state.mas_drawn_polygon and not drawings:
-                        st.session_state.mas_drawn_polygon = None
-                        st.session_state.mas_sites_in_polygon = 0
-
-        except Exception as e:
-            st.warning(f"Could not load map: {str(e)}")
-            st.info("You can still chat with the Multi-Agent Supervisor without the map.")
-
-    with info_col:
-        st.markdown("""
-        <div style="background: #f8f9fa; border-radius: 8px; padding: 1rem; height: 100%;">
-            <h4 style="color: #1a1a1a; margin: 0 0 0.75rem 0; font-size: 0.95rem;">📌 How to Use</h4>
-            <ol style="color: #666; font-size: 0.8rem; padding-left: 1.2rem; margin: 0;">
-                <li style="margin-bottom: 0.5rem;">Click the polygon 🔷 or rectangle ⬜ tool on the map</li>
-                <li style="margin-bottom: 0.5rem;">Draw a shape around the area you want to query</li>
-                <li style="margin-bottom: 0.5rem;">Ask a question about sites in that area</li>
-            </ol>
-        </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown("<div style='height: 0.5rem;'></div>", unsafe_allow_html=True)
-
-        # Show polygon status
-        if st.session_state.mas_drawn_polygon:
-            st.success(f"✅ **{st.session_state.mas_sites_in_polygon}** sites selected")
-            if st.button("🗑️ Clear Selection", key="clear_mas_polygon"):
-                st.session_state.mas_drawn_polygon = None
-                st.session_state.mas_sites_in_polygon = 0
-                st.rerun()
-        else:
-            st.info("No area selected")
+    show_region_selection_map("mas_map", "mas_", "You can still chat with the Multi-Agent Supervisor without the map.")
 
     st.markdown("---")
 
     # Clear chat history button (only show if there's history)
     if st.session_state.mas_messages:
-        if st.button("🗑️ Clear Chat History", key="clear_mas"):
-            st.session_state.mas_messages = []
-            st.rerun()
+        st.button("🗑️ Clear Chat History", key="clear_mas", on_click=set_session_state, kwargs={"mas_messages": []})
         st.markdown("---")
 
     # Display chat history (only completed exchanges)
@@ -1717,19 +2351,19 @@ def show_multi_agent_supervisor():
             st.markdown(message["content"])
 
     # Chat input
-    placeholder_text = "Ask about sites in the selected area..." if st.session_state.mas_drawn_polygon else "Ask about alerts, events, or system health..."
+    placeholder_text = "Ask about sites in the selected area..." if st.session_state.mas_drawn_shapes else "Ask about alerts, events, or system health..."
 
     if prompt := st.chat_input(placeholder_text):
         # Display user message (don't add to history yet)
         with st.chat_message("user"):
             st.markdown(prompt)
-            if st.session_state.mas_drawn_polygon:
-                st.caption(f"🗺️ Query includes {st.session_state.mas_sites_in_polygon} sites from selected polygon")
+            if st.session_state.mas_drawn_shapes:
+                st.caption(f"🗺️ Query includes {st.session_state.mas_sites_in_polygon} sites from the selected area")
 
         # Build the enhanced prompt with polygon context if available
         enhanced_prompt = prompt
-        if st.session_state.mas_drawn_polygon:
-            polygon_context = format_polygon_for_query(st.session_state.mas_drawn_polygon)
+        if st.session_state.mas_drawn_shapes:
+            polygon_context = format_polygon_for_query(st.session_state.mas_selection_wkt)
             enhanced_prompt = f"{prompt}\n\n{polygon_context}"
 
         # Get response from Multi-Agent Supervisor
@@ -0,0 +1,107 @@
+"""Benchmark the dashboard's per-rerun data work, before and after the presentation rework.
+
+Uses only the Streamlit-free helpers in portfolio_snapshot.py and site_map.py (numpy and pandas),
+so it runs anywhere from the repository root, without a workspace or warehouse:
+
+    python bench_dashboard.py
+
+Warehouse round trips are excluded; both paths start from rows already in memory.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from portfolio_snapshot import (DETAIL_PAGE_SIZE, bitmap_row_positions, build_snapshot, filter_selections,
+                                format_detail_table, kpis_from_totals, lookup_kpi_totals, selection_bitmap)
+from site_map import DASHBOARD_MAP_ZOOM, build_site_map, build_site_map_layer, site_map_figure, site_map_points
+
+SIZES = [10_000, 100_000]
+REPEATS = 5
+NUMERIC_COLUMNS = ['total_monthly_revenue', 'revenue_per_sqft', 'days_until_expiration',
+                   'insurance_liability_min_usd', 'equipment_space_sqft']
+
+
+def synthetic_portfolio(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'site_name': [f"SITE-{i:07d}" for i in range(n)],
+        'state': rng.choice(['TX', 'CA', 'NY', 'FL', 'WA', 'IL', 'GA', 'OH'], n),
+        'document_type': rng.choice(['Ground Lease', 'Rooftop Lease', 'Amendment'], n),
+        'tenant_name': rng.choice([f"Tenant {i}" for i in range(40)], n),
+        'latitude': rng.uniform(25, 49, n),
+        'longitude': rng.uniform(-124, -67, n),
+        'total_monthly_revenue': rng.uniform(500, 20_000, n),
+        'lease_status': rng.choice(['Active', 'Expired'], n, p=[0.9, 0.1]),
+        'days_until_expiration': rng.integers(0, 3_650, n).astype(float),
+        'revenue_per_sqft': rng.uniform(1, 60, n),
+        'insurance_liability_min_usd': rng.uniform(1e5, 5e6, n),
+        'equipment_space_sqft': rng.uniform(50, 2_000, n),
+        'compliance_status': rng.choice(['Compliant', 'Non-Compliant', 'Pending Review'], n),
+    })
+
+
+def baseline_rerun(raw, state, selected_site):
+    """The original show_dashboard data path (minus the warehouse queries)."""
+    def query(frame):
+        return frame[(frame['lease_status'] == 'Active') & (frame['state'] == state)].reset_index(drop=True)
+
+    df = query(raw)
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['total_monthly_revenue'].sum()
+    df['days_until_expiration'].mean()
+    df['revenue_per_sqft'].mean()
+    lower = df['compliance_status'].str.lower()
+    len(df[lower.str.contains('compliant', na=False) & ~df['compliance_status'].str.lower().str.contains('non', na=False)])
+
+    df_display = query(raw).copy()  # second, identical query_data call
+    df_display = df_display.dropna(subset=['total_monthly_revenue', 'latitude', 'longitude'])
+    df_display = df_display.reset_index(drop=True)
+    df_display['revenue_display'] = df_display['total_monthly_revenue'].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
+    df_display['marker_size'] = df_display['site_name'].apply(lambda x: 20 if x == selected_site else 10)
+    df_display['marker_color'] = df_display['site_name'].apply(lambda x: '#e63946' if x == selected_site else '#2196F3')
+    df_display['marker_color'].tolist()
+
+    display_df = df[['site_name', 'state', 'tenant_name', 'document_type', 'total_monthly_revenue', 'revenue_per_sqft',
+                     'days_until_expiration', 'insurance_liability_min_usd']].sort_values(
+        'total_monthly_revenue', ascending=False).head(50).copy()
+    for col in ['total_monthly_revenue', 'revenue_per_sqft', 'insurance_liability_min_usd']:
+        display_df[col] = display_df[col].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "N/A")
+    display_df['days_until_expiration'] = display_df['days_until_expiration'].apply(lambda x: f"{x:,.0f}" if pd.notna(x) else "N/A")
+
+
+def current_rerun(snapshot, state, selected_site):
+    """The current path: one bitmap-filtered frame, cube KPIs, clustered typed-array map, one formatted page."""
+    index = snapshot["index"]
+    selections = filter_selections((state,))
+    leases = snapshot["df"].take(bitmap_row_positions(index, selection_bitmap(index, selections)))
+    kpis_from_totals(lookup_kpi_totals(snapshot["cube"], (state,)))
+    site_map = build_site_map(site_map_points(leases))  # a site-map cache miss
+    view = {"filters": (state,), "zoom": DASHBOARD_MAP_ZOOM, "center": tuple(site_map["center"].values())}
+    site_map_figure(site_map, build_site_map_layer(site_map, view["zoom"]), view, selected_site)
+    format_detail_table(leases.sort_values('total_monthly_revenue', ascending=False).head(DETAIL_PAGE_SIZE))
+
+
+def best_of(fn, *args):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    print(f"{'rows':>8}  {'before (ms)':>12}  {'after (ms)':>11}  {'speedup':>8}")
+    for n in SIZES:
+        raw = synthetic_portfolio(n)
+        snapshot = build_snapshot(raw.copy(), None)
+        selected_site = raw['site_name'].iloc[n // 2]
+        before = best_of(baseline_rerun, raw, 'TX', selected_site)
+        after = best_of(current_rerun, snapshot, 'TX', selected_site)
+        print(f"{n:>8,}  {before:>12.1f}  {after:>11.1f}  {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""In-memory portfolio snapshot: the encoded lease frame and the indexes the dashboard reads.
+
+Built once per loaded version of synth_data and shared read-only across reruns and sessions:
+a KPI cube for the metric cards, per-value bitmaps for the filters, pre-sorted orders for the
+detail table, and the formatting of the rows a table page shows. Nothing here reads the
+warehouse or Streamlit state; app.py loads the rows and caches the snapshot.
+"""
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_COLUMNS = [
+    'site_name', 'state', 'document_type', 'tenant_name', 'latitude', 'longitude',
+    'total_monthly_revenue', 'lease_status', 'days_until_expiration', 'revenue_per_sqft',
+    'insurance_liability_min_usd', 'equipment_space_sqft', 'compliance_status'
+]
+
+# Low-cardinality text columns are held as categoricals (integer codes + one copy of each string)
+CATEGORICAL_COLUMNS = ['state', 'document_type', 'tenant_name', 'lease_status', 'compliance_status']
+
+def normalize_filter_values(value):
+    """Turn a selectbox/multiselect value into a sorted tuple of concrete values ("All" = no filter)"""
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    return tuple(sorted({v for v in value if v is not None and v != "All"}))
+
+# ============ KPI CUBE ============
+# Additive KPI measures pre-aggregated over every (state, document type, tenant,
+# compliance status) combination, with "All" rollups, so the metric cards are
+# dictionary lookups for any filter combination.
+COMPLIANCE_COMPLIANT, COMPLIANCE_PENDING, COMPLIANCE_NON_COMPLIANT = 0, 1, 2
+CUBE_DIMENSIONS = ['state', 'document_type', 'tenant_name', 'compliance_status']
+
+COMPLIANCE_LABEL_COLORS = {
+    COMPLIANCE_COMPLIANT: "metric-label-green",
+    COMPLIANCE_PENDING: "metric-label-orange",
+    COMPLIANCE_NON_COMPLIANT: "metric-label-red"
+}
+
+def classify_compliance(status):
+    """Map compliance_status strings to compliant/pending/non-compliant class codes"""
+    if isinstance(status.dtype, pd.CategoricalDtype):
+        # Classify each distinct status once, then gather by category code
+        category_classes = classify_compliance(pd.Series(status.cat.categories))
+        codes = status.cat.codes.to_numpy()
+        return np.where(codes >= 0, category_classes[codes], COMPLIANCE_NON_COMPLIANT).astype(np.int8)
+    lower = status.astype("string").str.lower()
+    compliant = lower.str.contains('compliant', na=False) & ~lower.str.contains('non', na=False)
+    pending = lower.str.contains('pending', na=False)
+    return np.where(compliant, COMPLIANCE_COMPLIANT,
+                    np.where(pending, COMPLIANCE_PENDING, COMPLIANCE_NON_COMPLIANT)).astype(np.int8)
+
+def compliance_classes(df):
+    """Precomputed compliance class codes, or classified on the fly for SQL result frames"""
+    if 'compliance_class' in df.columns:
+        return df['compliance_class'].to_numpy()
+    return classify_compliance(df['compliance_status'])
+
+def _measure_frame(df):
+    """Per-row additive measures from which every KPI card can be derived"""
+    days = df['days_until_expiration']
+    rpsf = df['revenue_per_sqft']
+    return pd.DataFrame({
+        'leases': 1,
+        'revenue': df['total_monthly_revenue'].fillna(0),
+        'days_sum': days.fillna(0),
+        'days_count': days.notna().astype(int),
+        'rpsf_sum': rpsf.fillna(0),
+        'rpsf_count': rpsf.notna().astype(int),
+        'compliant': (compliance_classes(df) == COMPLIANCE_COMPLIANT).astype(int)
+    }, index=df.index)
+
+MEASURES = ['leases', 'revenue', 'days_sum', 'days_count', 'rpsf_sum', 'rpsf_count', 'compliant']
+EMPTY_TOTALS = dict.fromkeys(MEASURES, 0)
+
+def build_metrics_cube(df, active):
+    """Materialize KPI totals for every filter combination (None = "All")"""
+    leases = df.loc[active]
+    measures = _measure_frame(leases)
+    base = pd.concat([leases[CUBE_DIMENSIONS], measures], axis=1)
+    # compliance_status refines the compliance class, so the filter on the raw status is a lookup too
+    base = base.groupby(CUBE_DIMENSIONS, dropna=False, observed=True)[MEASURES].sum().reset_index()
+
+    cube = {(None,) * len(CUBE_DIMENSIONS): base[MEASURES].sum().to_dict()}
+    for size in range(1, len(CUBE_DIMENSIONS) + 1):
+        for dims in itertools.combinations(CUBE_DIMENSIONS, size):
+            grouped = base.groupby(list(dims), dropna=False, observed=True)[MEASURES].sum().reset_index()
+            # Key columns in CUBE_DIMENSIONS order, None for the rolled-up dimensions
+            keys = zip(*(grouped[dim].tolist() if dim in dims else [None] * len(grouped) for dim in CUBE_DIMENSIONS))
+            cube.update(zip(keys, grouped[MEASURES].to_dict('records')))
+    return cube
+
+def lookup_kpi_totals(cube, state_filter=None, doc_type_filter=None, tenant_filter=None, compliance_filter=None):
+    """KPI totals for a filter combination: one cell per selected value combination"""
+    choices = [normalize_filter_values(value) or (None,)
+               for value in (state_filter, doc_type_filter, tenant_filter, compliance_filter)]
+    totals = dict(EMPTY_TOTALS)
+    for key in itertools.product(*choices):
+        cell = cube.get(key)
+        if cell:
+            for measure in MEASURES:
+                totals[measure] += cell[measure]
+    return totals
+
+def summarize_leases(df):
+    """KPI totals computed directly from a (small) lease frame"""
+    return _measure_frame(df)[MEASURES].sum().to_dict() if len(df) else dict(EMPTY_TOTALS)
+
+def kpis_from_totals(totals):
+    """Turn additive totals into the four card values (NaN-safe)"""
+    leases = int(totals['leases'])
+    return {
+        'total_revenue': float(totals['revenue']),
+        'num_leases': leases,
+        'avg_days_remaining': totals['days_sum'] / totals['days_count'] if totals['days_count'] else 0,
+        'avg_revenue_per_sqft': totals['rpsf_sum'] / totals['rpsf_count'] if totals['rpsf_count'] else 0,
+        'compliance_rate': totals['compliant'] / leases * 100 if leases else 0
+    }
+
+# ============ FILTER OPTIONS & BITMAP INDEXES ============
+# Dropdown domains are dictionary-encoded: sorted values plus aligned active-lease counts.
+# Locally, the active leases of each filter value are kept as a sorted slice of bit ids. Columns
+# with few values also keep a packed bitmap per value (size/8 bytes each, e.g. ~31 KB at 250k
+# leases), so their filters are a bitwise OR; high-cardinality columns such as tenants build
+# the bitmap of just the selected values from their slices. Filtering then ANDs one bitmap
+# per column, and the cascading option counts are one bincount of the column's value codes
+# over the rows the other filters select.
+FILTER_OPTION_COLUMNS = ['state', 'document_type', 'tenant_name', 'compliance_status']
+DENSE_BITMAP_MAX_VALUES = 64  # columns with more distinct values keep only the row-id slices
+
+def encode_filter_options(values, counts):
+    """Compact option list for one column; values with no matching leases are dropped"""
+    counts = np.asarray(counts, dtype=np.int64)
+    keep = counts > 0
+    return {
+        "values": [value for value, kept in zip(values, keep) if kept],
+        "counts": counts[keep]
+    }
+
+def filter_option_label(options):
+    """format_func for a filter widget showing each option's lease count"""
+    counts = dict(zip(options["values"], options["counts"].tolist()))
+    return lambda value: f"{value} ({counts.get(value, 0):,})"
+
+def packed_bit_masks(bits):
+    """Byte offsets and big-endian bit masks (np.packbits order) for bit ids"""
+    return bits >> 3, (0x80 >> (bits & 7)).astype(np.uint8)
+
+def bits_to_bitmap(bits, size):
+    """Packed bitmap with the given bit ids set"""
+    bitmap = np.zeros((size + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(bitmap, *packed_bit_masks(bits))
+    return bitmap
+
+def build_bitmap_indexes(df, active):
+    """Per-value row-id slices (and packed bitmaps for low-cardinality columns) over the active leases"""
+    rows = np.flatnonzero(active)
+    size = len(rows)
+    columns = {}
+    for column in FILTER_OPTION_COLUMNS:
+        codes, uniques = pd.factorize(df[column].take(rows), sort=True)  # nulls get code -1
+        codes = codes.astype(np.int32)
+        # Bit ids grouped by value code: value c owns order[bounds[c]:bounds[c + 1]]
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        entry = {
+            "values": uniques.tolist(),
+            "position": {value: code for code, value in enumerate(uniques.tolist())},
+            "order": order,
+            "bounds": bounds,
+            "codes": codes,  # value code per bit, -1 for nulls
+            "counts": np.diff(bounds)  # active leases per value
+        }
+        if len(uniques) <= DENSE_BITMAP_MAX_VALUES:
+            # Every value's bits set in one pass over the rows
+            bits = np.flatnonzero(codes >= 0)
+            entry["bitmaps"] = np.zeros((len(uniques), (size + 7) // 8), dtype=np.uint8)
+            byte, mask = packed_bit_masks(bits)
+            np.bitwise_or.at(entry["bitmaps"], (codes[bits], byte), mask)
+        columns[column] = entry
+    return {
+        "rows": rows,  # bit i <-> snapshot row rows[i]
+        "size": size,
+        "all": np.packbits(np.ones(size, dtype=bool)),
+        "columns": columns
+    }
+
+def values_bitmap(index, entry, codes):
+    """OR of the bitmaps of some values of one column"""
+    if "bitmaps" in entry:
+        return np.bitwise_or.reduce(entry["bitmaps"][codes], axis=0)
+    order, bounds = entry["order"], entry["bounds"]
+    return bits_to_bitmap(np.concatenate([order[bounds[code]:bounds[code + 1]] for code in codes]), index["size"])
+
+def selection_bitmap(index, selections, exclude=None):
+    """AND across columns of the OR of each column's selected value bitmaps"""
+    bitmap = index["all"]
+    for column, values in selections.items():
+        if column == exclude or not values:
+            continue
+        entry = index["columns"][column]
+        codes = [entry["position"][value] for value in values if value in entry["position"]]
+        if codes:
+            bitmap = bitmap & values_bitmap(index, entry, codes)
+        else:
+            bitmap = np.zeros_like(bitmap)
+    return bitmap
+
+def bitmap_row_positions(index, bitmap):
+    """Snapshot row positions whose bits are set"""
+    return index["rows"][np.flatnonzero(np.unpackbits(bitmap, count=index["size"]))]
+
+def cascading_filter_options(index, selections):
+    """Options per column that still intersect the other columns' selections, with counts"""
+    options = {}
+    for column in FILTER_OPTION_COLUMNS:
+        others = selection_bitmap(index, selections, exclude=column)
+        entry = index["columns"][column]
+        if others is index["all"]:
+            counts = entry["counts"]  # the other columns select nothing
+        else:
+            codes = entry["codes"][np.flatnonzero(np.unpackbits(others, count=index["size"]))]
+            counts = np.bincount(codes[codes >= 0], minlength=len(entry["values"]))
+        options[column] = encode_filter_options(entry["values"], counts)
+    return options
+
+def filter_selections(state_filter=None, doc_type_filter=None, tenant_filter=None, compliance_filter=None):
+    """Normalized {column: values} mapping for the dashboard filters"""
+    return dict(zip(FILTER_OPTION_COLUMNS, map(normalize_filter_values,
+                                               (state_filter, doc_type_filter, tenant_filter, compliance_filter))))
+
+# ============ DETAIL TABLE SORT ORDERS ============
+# Every sortable column keeps the active leases pre-sorted (as bit ids, missing values last),
+# so a table page is a scan of the selection bits in that order and only the page's rows
+# are materialized. Leases have no id, so ties are broken by every projected column
+# (SNAPSHOT_COLUMNS, ascending, missing last): a total order, so paging never repeats or skips
+# a row, and the warehouse's ORDER BY in query_detail_page_pushdown uses the same key.
+# Descending reverses the whole key, keeping rows with a missing sort value last.
+DETAIL_PAGE_SIZE = 50
+SORTABLE_DETAIL_COLUMNS = ['total_monthly_revenue', 'revenue_per_sqft', 'days_until_expiration', 'insurance_liability_min_usd']
+
+def tiebreak_ranks(df):
+    """Rank of every row over all projected columns, the tiebreak for equal sort values"""
+    keys = []
+    for column in reversed(SNAPSHOT_COLUMNS):  # lexsort takes its primary key last
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Sort the few categories rather than every row (code point order, as the
+            # warehouse's binary string collation)
+            category_ranks = np.argsort(np.argsort(values.cat.categories.to_numpy(dtype=object), kind='stable'))
+            codes, missing = values.cat.codes.to_numpy(), len(category_ranks)
+            keys.append(np.where(codes < 0, missing, category_ranks[codes]))
+            continue
+        if pd.api.types.is_numeric_dtype(values):
+            codes, uniques = pd.factorize(values.to_numpy(dtype=float, na_value=np.nan), sort=True)
+        else:
+            codes, uniques = pd.factorize(values.to_numpy(dtype=object), sort=True)
+        keys.append(np.where(codes < 0, len(uniques), codes))  # missing last
+    ranks = np.empty(len(df), dtype=np.int64)
+    ranks[np.lexsort(keys)] = np.arange(len(df))
+    return ranks
+
+def detail_sort_order(values, ranks):
+    """Ascending order by one column's values (NaN last), ties broken by the row ranks"""
+    return np.lexsort((ranks, values))
+
+def descending_runs(ranks, split):
+    """Reverse the non-missing run and the missing run separately, so missing values stay last"""
+    return np.concatenate([ranks[:split][::-1], ranks[split:][::-1]])
+
+def build_sort_orders(df, index):
+    """Ascending bit-id order of the active leases for each sortable column"""
+    active = df.take(index["rows"])
+    ranks = tiebreak_ranks(active)
+    orders = {}
+    for column in SORTABLE_DETAIL_COLUMNS:
+        values = active[column].to_numpy(dtype=float, na_value=np.nan)
+        orders[column] = {
+            "order": detail_sort_order(values, ranks),
+            "valid": int(np.count_nonzero(~np.isnan(values)))
+        }
+    return orders
+
+def sorted_page_positions(index, sort_order, bitmap, descending=True, page=0, page_size=DETAIL_PAGE_SIZE):
+    """Snapshot row positions of one page of the selection, in sort order"""
+    bits = np.unpackbits(bitmap, count=index["size"]).view(bool)
+    ranks = np.flatnonzero(bits[sort_order["order"]])
+    if descending:
+        ranks = descending_runs(ranks, np.searchsorted(ranks, sort_order["valid"]))
+    page_ranks = ranks[page * page_size:(page + 1) * page_size]
+    return index["rows"][sort_order["order"][page_ranks]]
+
+def sort_detail_rows(df, sort_column, descending=True):
+    """A handful of leases (one site's) in the same order the paged table uses"""
+    values = df[sort_column].to_numpy(dtype=float, na_value=np.nan)
+    order = detail_sort_order(values, tiebreak_ranks(df))
+    if descending:
+        order = descending_runs(order, int(np.count_nonzero(~np.isnan(values))))
+    return df.take(order)
+
+# ============ DETAIL TABLE FORMATTING ============
+DETAIL_COLUMNS = {
+    'site_name': 'Site Name',
+    'state': 'State',
+    'tenant_name': 'Tenant',
+    'document_type': 'Document Type',
+    'total_monthly_revenue': 'Monthly Revenue',
+    'revenue_per_sqft': 'Revenue/SqFt',
+    'days_until_expiration': 'Days Remaining',
+    'insurance_liability_min_usd': 'Insurance Liability'
+}
+CURRENCY_COLUMNS = ['total_monthly_revenue', 'revenue_per_sqft', 'insurance_liability_min_usd']
+
+def format_currency(values):
+    """'$1,234.56' strings for a numeric column ('N/A' for missing)"""
+    return ("$" + values.map("{:,.2f}".format)).where(values.notna(), "N/A")
+
+def format_count(values):
+    """'1,234' strings for a numeric column ('N/A' for missing)"""
+    return values.map("{:,.0f}".format).where(values.notna(), "N/A")
+
+def format_detail_table(rows):
+    """Display-ready copy of the (already paged) detail rows"""
+    table = rows[list(DETAIL_COLUMNS)].copy()
+    for column in CURRENCY_COLUMNS:
+        table[column] = format_currency(table[column])
+    table['days_until_expiration'] = format_count(table['days_until_expiration'])
+    return table.rename(columns=DETAIL_COLUMNS)
+
+# ============ PORTFOLIO SNAPSHOT ============
+# The lease frame plus every structure above, rebuilt whenever a new version is loaded
+def encode_lease_columns(df):
+    """Dictionary-encode low-cardinality columns and precompute the compliance class"""
+    df = df.astype({column: "category" for column in CATEGORICAL_COLUMNS
+                    if not isinstance(df[column].dtype, pd.CategoricalDtype)})
+    df['compliance_class'] = classify_compliance(df['compliance_status'])
+    return df
+
+def build_snapshot(df, version):
+    """Wrap a lease frame with the derived structures every view reads"""
+    df = encode_lease_columns(df)
+    active = (df['lease_status'] == 'Active').to_numpy()
+    index = build_bitmap_indexes(df, active)
+    return {
+        "pushdown": False,
+        "df": df,
+        "active": active,
+        "cube": build_metrics_cube(df, active),
+        "index": index,
+        "sort_orders": build_sort_orders(df, index),
+        "version": version,
+        "loaded_at": time.time()
+    }
@@ -0,0 +1,154 @@
+"""Site spatial index and region queries for the lease map.
+
+A packed R-tree (Shapely STRtree) over the site points. Region queries prune to the points
+whose box can match in the tree, and only those candidates get the exact test. Results are
+sorted row positions into the site frame. Membership follows Databricks ST_Intersects:
+points on a boundary or vertex count as inside.
+
+Drawn selections are sent to the warehouse as compact WKT: their union is simplified
+(Douglas-Peucker, topology-preserving) with the largest tolerance that still selects the
+same sites, then written with the fewest decimals that still do.
+"""
+import os
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+EARTH_RADIUS_M = 6371008.8
+# Past this many vertices a selection is simplified further, even if a few sites change sides (0 = no cap)
+SELECTION_MAX_VERTICES = int(os.environ.get("SELECTION_MAX_VERTICES", "200"))
+SELECTION_WKT_DECIMALS = (3, 4, 5)  # tried in order; 6 decimals (~0.1 m) otherwise
+SELECTION_TOLERANCE_STEPS = 16  # tolerances halve from half the selection's extent
+SELECTION_TOLERANCE_REFINE_STEPS = 4  # then bisect between the last good and first bad one
+
+def build_site_index(sites):
+    """STRtree over the site coordinates"""
+    lat = sites['latitude'].to_numpy(dtype=float)
+    lon = sites['longitude'].to_numpy(dtype=float)
+    return {"tree": shapely.STRtree(shapely.points(lon, lat)), "lat": lat, "lon": lon, "size": len(lat)}
+
+def query_sites_in_bbox(index, south, west, north, east):
+    """Sites inside a lat/lon bounding box, edges included (the tree answers this exactly)"""
+    return np.sort(index["tree"].query(shapely.box(west, south, east, north)))
+
+def selection_geometry(shapes):
+    """Union of drawn shapes ([lon, lat] rings) as one valid Polygon or MultiPolygon (None if nothing has area)"""
+    parts = []
+    for ring in shapes or []:
+        try:
+            # make_valid splits a self-intersecting ring into polygons (and may leave line scraps)
+            polygon = shapely.make_valid(Polygon([point[:2] for point in ring]))
+        except (ValueError, TypeError, shapely.errors.GEOSException):
+            continue
+        parts.extend(part for part in shapely.get_parts(shapely.get_parts(polygon)) if part.geom_type == "Polygon")
+    if not parts:
+        return None
+    # Overlapping shapes merge, so the result is valid WKT for the warehouse as well
+    union = shapely.union_all(parts)
+    return None if union.is_empty else union
+
+def query_sites_in_geometry(index, geometry):
+    """Sites inside or on a (Multi)Polygon, tested in one vectorized pass"""
+    if geometry is None:
+        return np.empty(0, dtype=np.int64)
+    envelope = geometry.envelope
+    if geometry.geom_type == "Polygon" and geometry.area > 0 and abs(geometry.area - envelope.area) <= 1e-12 * envelope.area:
+        # An axis-aligned rectangle (the rectangle tool) is its own bounding box
+        return query_sites_in_bbox(index, *np.array(geometry.bounds)[[1, 0, 3, 2]])
+    # Candidates whose point falls in any shape's box (one tree query for all shapes), then one exact
+    # test on them; intersects (not contains) matches Databricks ST_Intersects: the boundary counts as inside
+    candidates = np.unique(index["tree"].query(shapely.get_parts(geometry))[1])
+    shapely.prepare(geometry)
+    return candidates[shapely.intersects_xy(geometry, index["lon"][candidates], index["lat"][candidates])]
+
+def query_sites_in_radius(index, lat, lon, radius_m):
+    """Sites within radius_m metres (great-circle distance) of a point"""
+    angle = radius_m / EARTH_RADIUS_M
+    cos_lat = np.cos(np.radians(lat))
+    # Widest longitude span of the circle at this latitude (the whole globe near the poles)
+    lon_span = 180.0 if np.sin(angle) >= cos_lat else np.degrees(np.arcsin(np.sin(angle) / cos_lat))
+    lat_span = np.degrees(angle)
+    candidates = query_sites_in_bbox(index, lat - lat_span, lon - lon_span, lat + lat_span, lon + lon_span)
+    # Exact haversine test on the candidates only
+    lat1, lat2 = np.radians(lat), np.radians(index["lat"][candidates])
+    dlon = np.radians(index["lon"][candidates] - lon)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return candidates[2 * np.arcsin(np.sqrt(np.minimum(h, 1.0))) <= angle]
+
+def positions_mask(size, positions):
+    """Boolean row mask from sorted row positions"""
+    mask = np.zeros(size, dtype=bool)
+    mask[positions] = True
+    return mask
+
+def selection_filter_candidate(index, geometry, tolerance, decimals=None):
+    """A selection simplified with one tolerance and written as WKT, with the sites its WKT selects"""
+    simplified = shapely.simplify(geometry, tolerance, preserve_topology=True) if tolerance > 0 else geometry
+    if decimals is not None:
+        # Snapping to the grid keeps the geometry valid, unlike rounding the WKT text alone
+        simplified = shapely.set_precision(simplified, 10.0 ** -decimals)
+    if simplified.is_empty:
+        return None
+    wkt = shapely.to_wkt(simplified, rounding_precision=decimals if decimals is not None else -1)
+    # Read back, so the local geometry is exactly the one the warehouse parses
+    geometry = shapely.from_wkt(wkt)
+    shapely.prepare(geometry)
+    return {"wkt": wkt, "geometry": geometry, "positions": query_sites_in_geometry(index, geometry),
+            "vertices": int(shapely.get_num_coordinates(geometry))}
+
+def build_selection_filter(index, shapes, max_vertices=SELECTION_MAX_VERTICES):
+    """Compact WKT filter for a drawing set, verified to select the same sites as the drawn shapes
+
+    Only the vertex cap may change the sites; "changed" counts the sites it added or dropped.
+    """
+    exact = selection_geometry(shapes)
+    if exact is None:
+        return None
+    shapely.prepare(exact)
+    target = query_sites_in_geometry(index, exact)
+
+    def keeps_sites(candidate):
+        return candidate is not None and np.array_equal(candidate["positions"], target)
+
+    x0, y0, x1, y1 = exact.bounds
+    extent = max(x1 - x0, y1 - y0)
+    tolerances = [0.0] + [extent * 0.5 ** step for step in range(SELECTION_TOLERANCE_STEPS, 0, -1)]
+    best = selection_filter_candidate(index, exact, 0.0, 6)
+    if not keeps_sites(best):
+        # A site within ~0.1 m of the boundary: send the shape at full precision
+        best = selection_filter_candidate(index, exact, 0.0)
+    else:
+        # Largest tolerance that keeps the same sites, by binary search over the ladder
+        low, high = 0, len(tolerances) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            candidate = selection_filter_candidate(index, exact, tolerances[middle], 6)
+            if keeps_sites(candidate):
+                low, best = middle, candidate
+            else:
+                high = middle - 1
+        tolerance = tolerances[low]
+        if low + 1 < len(tolerances):
+            bad = tolerances[low + 1]
+            for _ in range(SELECTION_TOLERANCE_REFINE_STEPS):
+                candidate = selection_filter_candidate(index, exact, (tolerance + bad) / 2, 6)
+                if keeps_sites(candidate):
+                    tolerance, best = (tolerance + bad) / 2, candidate
+                else:
+                    bad = (tolerance + bad) / 2
+        # Then the fewest decimals that still keep them
+        for decimals in SELECTION_WKT_DECIMALS:
+            candidate = selection_filter_candidate(index, exact, tolerance, decimals)
+            if keeps_sites(candidate):
+                best = candidate
+                break
+        # Vertex cap: simplify further, accepting a changed site set
+        for tolerance in tolerances[low + 1:]:
+            if not max_vertices or best["vertices"] <= max_vertices:
+                break
+            candidate = selection_filter_candidate(index, exact, tolerance, 6)
+            if candidate is not None:
+                best = candidate
+    best["changed"] = len(np.setxor1d(best["positions"], target, assume_unique=True))
+    return best
@@ -0,0 +1,240 @@
+"""Site map level of detail and marker data for the dashboard and region maps.
+
+Sites are clustered per zoom level once per snapshot (or filter set); a view only picks the
+level and viewport it shows. The dashboard map is built from Plotly trace dicts with typed
+arrays, the region maps from GeoJSON. Nothing here reads Streamlit state; app.py caches the
+results and renders them.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+MARKER_COLOR = '#2196F3'
+SELECTED_MARKER_COLOR = '#e63946'
+CLUSTER_MARKER_COLOR = '#1565C0'
+DASHBOARD_MAP_HEIGHT_PX = 500
+DASHBOARD_MAP_ZOOM = 3  # MapLibre zoom of the initial dashboard view
+MAP_HOVER_COLUMNS = ['state', 'tenant_name', 'total_monthly_revenue', 'revenue_per_sqft']
+MAP_HOVER_FORMATS = {'total_monthly_revenue': ('Monthly Revenue', ':$,.2f'), 'revenue_per_sqft': ('Revenue/Sq Ft', ':.2f')}
+
+# ============ MAP LEVEL OF DETAIL ============
+# Sites are clustered on a Web Mercator quadtree: at zoom z a grid cell spans LOD_CELL_PIXELS
+# screen pixels, so every cell splits into four at z + 1. Counts, revenue and centroids are
+# precomputed for every level once per snapshot; a view only picks the level for its zoom (and,
+# for the region maps, the clusters inside the padded viewport they report). Past
+# LOD_MAX_CLUSTER_ZOOM sites are drawn one by one.
+LOD_CELL_PIXELS = 64
+LOD_MIN_ZOOM = 2
+LOD_MAX_CLUSTER_ZOOM = int(os.environ.get("LOD_MAX_CLUSTER_ZOOM", "10"))
+MERCATOR_MAX_LATITUDE = 85.0511
+# Zoom levels are in Leaflet's 256px tiles; Plotly's MapLibre maps use 512px tiles (one level less)
+MAPLIBRE_ZOOM_OFFSET = 1
+
+def mercator_xy(lat, lon):
+    """Web Mercator coordinates scaled to [0, 1] (x grows east, y grows south)"""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -MERCATOR_MAX_LATITUDE, MERCATOR_MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+def build_site_lod(points):
+    """Cluster levels (point -> cluster, counts, revenue, centroids) for every clustered zoom"""
+    lat = points['latitude'].to_numpy(dtype=float)
+    lon = points['longitude'].to_numpy(dtype=float)
+    revenue = np.nan_to_num(points['total_monthly_revenue'].to_numpy(dtype=float, na_value=np.nan))
+    x, y = mercator_xy(lat, lon)
+    levels = {}
+    for zoom in range(LOD_MIN_ZOOM, LOD_MAX_CLUSTER_ZOOM + 1):
+        cells = (256 << zoom) // LOD_CELL_PIXELS
+        cell_x = np.clip((x * cells).astype(np.int64), 0, cells - 1)
+        cell_y = np.clip((y * cells).astype(np.int64), 0, cells - 1)
+        _, cluster = np.unique(cell_x * cells + cell_y, return_inverse=True)
+        cluster = cluster.reshape(-1)
+        count = np.bincount(cluster, minlength=1)
+        first = np.zeros(len(count), dtype=np.int64)
+        first[cluster[::-1]] = np.arange(len(cluster))[::-1]  # lowest point index per cluster
+        centroid_lat = np.bincount(cluster, weights=lat, minlength=1) / np.maximum(count, 1)
+        centroid_lon = np.bincount(cluster, weights=lon, minlength=1) / np.maximum(count, 1)
+        centroid_x, centroid_y = mercator_xy(centroid_lat, centroid_lon)
+        levels[zoom] = {
+            "cluster": cluster,
+            "count": count,
+            "revenue": np.bincount(cluster, weights=revenue, minlength=1),
+            "lat": centroid_lat,
+            "lon": centroid_lon,
+            "x": centroid_x,
+            "y": centroid_y,
+            "point": np.where(count == 1, first, -1)  # one-site clusters are drawn as that site
+        }
+    return {"lat": lat, "lon": lon, "x": x, "y": y, "revenue": revenue, "levels": levels}
+
+def viewport_box(south, west, north, east, pad=1.0):
+    """Mercator box of a lat/lon viewport, grown by pad viewport sizes on every side"""
+    x0, y1 = mercator_xy(south, west)
+    x1, y0 = mercator_xy(north, east)
+    dx, dy = (x1 - x0) * pad, (y1 - y0) * pad
+    return (float(x0 - dx), float(y0 - dy), float(x1 + dx), float(y1 + dy))
+
+def lod_view(lod, zoom, box=None, highlight=None):
+    """Markers for one zoom and viewport: clusters, or individual sites past the cluster zooms"""
+    if zoom > LOD_MAX_CLUSTER_ZOOM:
+        count = np.ones(len(lod["lat"]), dtype=np.int64)
+        view = {"latitude": lod["lat"], "longitude": lod["lon"], "count": count,
+                "revenue": lod["revenue"], "point": np.arange(len(count))}
+        if highlight is not None:
+            view["highlighted"] = np.asarray(highlight, dtype=np.int64)
+        x, y = lod["x"], lod["y"]
+    else:
+        level = lod["levels"][max(int(zoom), LOD_MIN_ZOOM)]
+        view = {"latitude": level["lat"], "longitude": level["lon"], "count": level["count"],
+                "revenue": level["revenue"], "point": level["point"]}
+        if highlight is not None:
+            view["highlighted"] = np.bincount(level["cluster"], weights=highlight,
+                                              minlength=len(level["count"])).astype(np.int64)
+        x, y = level["x"], level["y"]
+    view = pd.DataFrame(view)
+    if len(lod["lat"]) == 0:
+        return view.iloc[0:0]
+    if box is not None:
+        x0, y0, x1, y1 = box
+        view = view[(x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)]
+    return view.reset_index(drop=True)
+
+def site_lod_geojson(lod, sites_df, zoom, box=None, highlight=None):
+    """GeoJSON points for one view's clusters and sites, with popup text and style properties"""
+    view = lod_view(lod, zoom, box, highlight)
+    point = view['point'].to_numpy()
+    single = point >= 0
+    names = sites_df['site_name'].to_numpy(dtype=object)
+    states = sites_df['state'].astype("string").fillna("N/A").to_numpy(dtype=object)
+    counts = view['count'].to_numpy()
+    highlighted = view['highlighted'].to_numpy() > 0 if highlight is not None else np.zeros(len(view), dtype=bool)
+    # Popup text and styling are per-feature properties; Leaflet builds popups only when clicked
+    label = np.where(single, names[np.maximum(point, 0)] if len(names) else "", [f"{count:,} sites" for count in counts])
+    if highlight is not None:
+        cluster_detail = [f"🎯 {count:,} in selected area · zoom in for sites" for count in view['highlighted']]
+    else:
+        cluster_detail = ["Zoom in to see individual sites"] * len(view)
+    detail = np.where(single, states[np.maximum(point, 0)] if len(names) else "", cluster_detail)
+    revenue = [f"${value:,.0f}/month" for value in view['revenue']]
+    radius = np.where(single, np.where(highlighted, 8, 6), np.minimum(8 + 2 * np.log2(np.maximum(counts, 1)), 24))
+    color = np.where(highlighted, SELECTED_MARKER_COLOR, MARKER_COLOR)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(lon, 6), round(lat, 6)]},
+                "properties": {"name": name, "detail": text, "revenue": money, "radius": round(float(size), 1), "color": fill}
+            }
+            for lat, lon, name, text, money, size, fill in zip(
+                view['latitude'].tolist(), view['longitude'].tolist(), label.tolist(), detail.tolist(),
+                revenue, radius.tolist(), color.tolist())
+        ]
+    }
+
+def site_marker_style(feature):
+    """Data-driven CircleMarker style for a site or cluster feature"""
+    properties = feature["properties"]
+    return {"radius": properties["radius"], "color": properties["color"], "fillColor": properties["color"],
+            "fillOpacity": 0.7, "weight": 2}
+
+# ============ DASHBOARD SITE MAP ============
+# Each zoom level becomes one cluster trace and one site trace of typed arrays; hover numbers
+# are formatted by the browser, and a selected site is a one-point overlay on the base traces.
+def site_map_points(leases):
+    """Plottable map points (rows with coordinates and revenue)"""
+    columns = ['site_name', 'latitude', 'longitude'] + [col for col in MAP_HOVER_COLUMNS if col in leases.columns]
+    valid = leases[['total_monthly_revenue', 'latitude', 'longitude']].notna().all(axis=1)
+    return leases.loc[valid, columns].reset_index(drop=True)
+
+def build_site_map(points):
+    """Per-site hover payloads (typed arrays) plus the LOD clusters for the dashboard map"""
+    names = points['site_name'].to_numpy(dtype=object)
+    # Numbers travel as one float array and are formatted by the browser (d3 formats)
+    measures = [col for col in MAP_HOVER_FORMATS if col in points.columns]
+    hover = ["<b>%{hovertext}</b>"]
+    text = None
+    if 'state' in points.columns and 'tenant_name' in points.columns:
+        text = (points['state'].astype("string").fillna("N/A") + " · " +
+                points['tenant_name'].astype("string").fillna("N/A")).to_numpy(dtype=object)
+        hover.append("%{text}")
+    hover += [f"{MAP_HOVER_FORMATS[col][0]}: %{{customdata[{i}]{MAP_HOVER_FORMATS[col][1]}}}"
+              for i, col in enumerate(measures)]
+    lod = build_site_lod(points)
+    return {
+        "site_names": names,
+        "text": text,
+        "customdata": points[measures].to_numpy(dtype=np.float64) if measures else None,
+        "hovertemplate": "<br>".join(hover) + "<extra></extra>",
+        "position": {name: i for i, name in enumerate(names)},
+        "lod": lod,
+        "center": {"lat": float(lod["lat"].mean()), "lon": float(lod["lon"].mean())} if len(names) else None
+    }
+
+def build_site_map_layer(site_map, zoom):
+    """Base traces for one zoom level: a cluster trace and a site trace (typed arrays)"""
+    # Every cluster of the level, not just those around the centre: Plotly does not report the
+    # user's own pans and zooms back, so the whole level must already be on the map
+    view = lod_view(site_map["lod"], zoom + MAPLIBRE_ZOOM_OFFSET)
+    singles = view["point"].to_numpy() >= 0
+    clusters = view[~singles]
+    sites = view.loc[singles, "point"].to_numpy()
+    cluster_trace = {
+        "type": "scattermap",
+        "mode": "markers",
+        "lat": clusters["latitude"].to_numpy(dtype=np.float32),
+        "lon": clusters["longitude"].to_numpy(dtype=np.float32),
+        "customdata": clusters[["count", "revenue"]].to_numpy(dtype=np.float64),
+        "hovertemplate": "<b>%{customdata[0]:,} sites</b><br>Monthly Revenue: %{customdata[1]:$,.2f}"
+                         "<br>Click to zoom in<extra></extra>",
+        "marker": {"size": np.minimum(12 + 4 * np.log2(clusters["count"].to_numpy(dtype=np.float64)), 40),
+                   "color": CLUSTER_MARKER_COLOR, "opacity": 0.75},
+        "showlegend": False
+    }
+    site_trace = {
+        "type": "scattermap",
+        "mode": "markers",
+        "lat": site_map["lod"]["lat"][sites].astype(np.float32),
+        "lon": site_map["lod"]["lon"][sites].astype(np.float32),
+        "hovertext": site_map["site_names"][sites],
+        "hovertemplate": site_map["hovertemplate"],
+        "marker": {"size": 10, "color": MARKER_COLOR},
+        "showlegend": False
+    }
+    if site_map["text"] is not None:
+        site_trace["text"] = site_map["text"][sites]
+    if site_map["customdata"] is not None:
+        site_trace["customdata"] = site_map["customdata"][sites]
+    return {
+        "data": [cluster_trace, site_trace],
+        "clusters": clusters[["latitude", "longitude"]].to_numpy(),
+        "sites": sites
+    }
+
+def site_map_figure(site_map, layer, view, selected_site=None):
+    """The cached base traces in a layout for the view, plus a one-point overlay for the selected site"""
+    layout = {
+        "map": {"style": "open-street-map", "center": {"lat": view["center"][0], "lon": view["center"][1]},
+                "zoom": view["zoom"]},
+        "height": DASHBOARD_MAP_HEIGHT_PX,
+        "margin": {"r": 0, "t": 0, "l": 0, "b": 0},
+        # The camera only moves when the app changes the view (a cluster click, zoom out, new
+        # filters); selecting a site keeps wherever the user has panned or zoomed to
+        "uirevision": repr((view["filters"], view["zoom"], view["center"]))
+    }
+    i = site_map["position"].get(selected_site) if selected_site else None
+    if i is None:
+        return {"data": layer["data"], "layout": layout}
+    overlay = {
+        "type": "scattermap",
+        "mode": "markers",
+        "lat": [float(site_map["lod"]["lat"][i])],
+        "lon": [float(site_map["lod"]["lon"][i])],
+        "hovertext": [selected_site],
+        "hovertemplate": "<b>%{hovertext}</b> (selected)<extra></extra>",
+        "marker": {"size": 18, "color": SELECTED_MARKER_COLOR},
+        "showlegend": False
+    }
+    return {"data": layer["data"] + [overlay], "layout": layout}
@@ -0,0 +1,92 @@
+"""The compact WKT sent for a drawn selection must select exactly the sites of the drawn shapes."""
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+from site_geometry import build_selection_filter, build_site_index, selection_geometry
+
+NO_VERTEX_CAP = 0
+
+
+def blob(rng, lon, lat, radius, vertices, noise=0.05):
+    """A wiggly hand-drawn-looking ring"""
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = radius * (1 + noise * rng.standard_normal(vertices))
+    return np.column_stack([lon + radii * np.cos(angles), lat + radii * np.sin(angles)]).tolist()
+
+
+def random_sites(rng, count):
+    return build_site_index(pd.DataFrame({"longitude": rng.uniform(-124, -67, count),
+                                          "latitude": rng.uniform(25, 49, count)}))
+
+
+def brute_force(geometry, index):
+    return np.flatnonzero(shapely.intersects_xy(geometry, index["lon"], index["lat"]))
+
+
+def selections():
+    rng = np.random.default_rng(11)
+    return {
+        "one blob": [blob(rng, -97, 32, 2, 60)],
+        "blobs and rectangle": [blob(rng, -97, 32, 2, 300), blob(rng, -84, 34, 1.5, 150),
+                                [[-80, 35], [-80, 40], [-75, 40], [-75, 35]]],
+        "overlapping": [blob(rng, -100, 40, 3, 80), blob(rng, -98, 40, 3, 80)],
+        "hand-drawn polygon": [[[-105.2, 39.1], [-103.9, 40.3], [-102.1, 39.8], [-102.8, 38.2], [-104.6, 37.9]]],
+    }
+
+
+@pytest.mark.parametrize("site_count", [2_000, 50_000])
+@pytest.mark.parametrize("name", list(selections()))
+def test_selected_sites_are_unchanged(name, site_count):
+    shapes = selections()[name]
+    index = random_sites(np.random.default_rng(site_count), site_count)
+    expected = brute_force(selection_geometry(shapes), index)
+
+    selection = build_selection_filter(index, shapes, max_vertices=NO_VERTEX_CAP)
+
+    np.testing.assert_array_equal(selection["positions"], expected)
+    assert selection["changed"] == 0
+    # What the warehouse parses from the WKT text selects the same sites
+    np.testing.assert_array_equal(brute_force(shapely.from_wkt(selection["wkt"]), index), expected)
+
+
+def test_simplification_shrinks_the_wkt():
+    shapes = selections()["one blob"]
+    index = random_sites(np.random.default_rng(3), 2_000)
+    selection = build_selection_filter(index, shapes, max_vertices=NO_VERTEX_CAP)
+    assert selection["vertices"] < shapely.get_num_coordinates(selection_geometry(shapes))
+    assert len(selection["wkt"]) < len(shapely.to_wkt(selection_geometry(shapes), rounding_precision=6))
+
+
+def test_vertex_cap_produces_valid_wkt():
+    shapes = selections()["blobs and rectangle"]
+    index = random_sites(np.random.default_rng(5), 50_000)
+    selection = build_selection_filter(index, shapes, max_vertices=60)
+    geometry = shapely.from_wkt(selection["wkt"])
+    assert geometry.is_valid
+    assert selection["vertices"] <= 60
+    np.testing.assert_array_equal(selection["positions"], brute_force(geometry, index))
+    # The sites the capped shape adds or drops are reported
+    exact = brute_force(selection_geometry(shapes), index)
+    assert selection["changed"] == len(np.setxor1d(selection["positions"], exact))
+    assert selection["changed"] > 0
+
+
+def test_full_precision_fallback_produces_valid_wkt():
+    # The west edge sits 4e-7 degrees off the 6-decimal grid and a site lies between the edge and the
+    # grid line, so any rounding drops it: the shape must be sent at full precision
+    shapes = [[[-90.0000004, 35.0], [-90.0000004, 37.0], [-86.0, 37.0], [-86.0, 35.0]]]
+    index = build_site_index(pd.DataFrame({"longitude": [-90.0000002, -88.0, -91.0],
+                                           "latitude": [36.0, 36.0, 36.0]}))
+    selection = build_selection_filter(index, shapes, max_vertices=NO_VERTEX_CAP)
+    geometry = shapely.from_wkt(selection["wkt"])
+    assert geometry.is_valid
+    assert "-90.0000004" in selection["wkt"]
+    np.testing.assert_array_equal(selection["positions"], [0, 1])
+    np.testing.assert_array_equal(brute_force(geometry, index), [0, 1])
+
+
+def test_shapes_without_area_have_no_filter():
+    index = build_site_index(pd.DataFrame({"longitude": [-88.0], "latitude": [36.0]}))
+    assert build_selection_filter(index, [[[-90.0, 35.0], [-89.0, 36.0], [-88.0, 37.0]]]) is None
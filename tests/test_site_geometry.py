@@ -0,0 +1,90 @@
+"""Region membership must match Databricks ST_Intersects: boundary and vertex points are inside."""
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import Point, Polygon
+
+from site_geometry import (build_site_index, positions_mask, query_sites_in_bbox, query_sites_in_geometry,
+                           selection_geometry)
+
+# [lon, lat] rings, as folium's draw tool returns them
+TRIANGLE = [[-100.0, 30.0], [-96.0, 30.0], [-100.0, 34.0]]
+RECTANGLE = [[-90.0, 35.0], [-90.0, 37.0], [-86.0, 37.0], [-86.0, 35.0], [-90.0, 35.0]]
+
+# (lon, lat, inside) for the triangle
+TRIANGLE_POINTS = [
+    (-99.0, 31.0, True),    # interior
+    (-98.0, 30.0, True),    # on the bottom edge
+    (-100.0, 32.0, True),   # on the left edge
+    (-98.0, 32.0, True),    # on the hypotenuse
+    (-100.0, 30.0, True),   # vertex
+    (-96.0, 30.0, True),    # vertex
+    (-100.0, 34.0, True),   # vertex
+    (-97.0, 33.0, False),   # outside, inside the bounding box
+    (-101.0, 31.0, False),  # outside the bounding box
+    (-98.0, 29.999, False),  # just below the bottom edge
+]
+
+
+def site_index(lons, lats):
+    return build_site_index(pd.DataFrame({"longitude": lons, "latitude": lats}))
+
+
+def scan(geometry, index):
+    """Reference: one Polygon.intersects call per site"""
+    return np.array([i for i, (lon, lat) in enumerate(zip(index["lon"], index["lat"]))
+                     if geometry.intersects(Point(lon, lat))], dtype=np.int64)
+
+
+def test_triangle_interior_edge_vertex_and_outside_points():
+    lons, lats, inside = zip(*TRIANGLE_POINTS)
+    index = site_index(lons, lats)
+    geometry = selection_geometry([TRIANGLE])
+    expected = np.flatnonzero(inside)
+    np.testing.assert_array_equal(query_sites_in_geometry(index, geometry), expected)
+    np.testing.assert_array_equal(scan(Polygon(TRIANGLE), index), expected)
+
+
+def test_intersects_xy_matches_polygon_intersects_on_the_boundary():
+    lons, lats, inside = map(np.array, zip(*TRIANGLE_POINTS))
+    polygon = Polygon(TRIANGLE)
+    shapely.prepare(polygon)
+    np.testing.assert_array_equal(shapely.intersects_xy(polygon, lons, lats), inside.astype(bool))
+
+
+def test_rectangle_fast_path_includes_edges_and_corners():
+    lons = [-88.0, -90.0, -86.0, -88.0, -90.0, -86.0, -85.999, -88.0]
+    lats = [36.0, 36.0, 36.0, 37.0, 35.0, 37.0, 36.0, 34.999]
+    index = site_index(lons, lats)
+    geometry = selection_geometry([RECTANGLE])
+    np.testing.assert_array_equal(query_sites_in_geometry(index, geometry), [0, 1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(query_sites_in_bbox(index, 35.0, -90.0, 37.0, -86.0), [0, 1, 2, 3, 4, 5])
+
+
+@pytest.mark.parametrize("shapes", [
+    [TRIANGLE],
+    [RECTANGLE],
+    [TRIANGLE, RECTANGLE],
+    [TRIANGLE, [[-99.0, 29.0], [-95.0, 29.0], [-95.0, 31.0], [-99.0, 31.0]]],  # overlapping shapes
+    [[[-94.0, 30.0], [-92.0, 32.0], [-92.0, 30.0], [-94.0, 32.0]]],  # self-intersecting bowtie
+])
+def test_matches_per_point_scan(shapes):
+    rng = np.random.default_rng(7)
+    lons = rng.uniform(-102, -84, 4000).round(1)  # on a 0.1 degree grid, so many land on edges
+    lats = rng.uniform(28, 38, 4000).round(1)
+    index = site_index(lons, lats)
+    geometry = selection_geometry(shapes)
+    reference = shapely.union_all([shapely.make_valid(Polygon(ring)) for ring in shapes])
+    np.testing.assert_array_equal(query_sites_in_geometry(index, geometry), scan(reference, index))
+
+
+def test_shapes_without_area_select_nothing():
+    index = site_index([-99.0], [31.0])
+    assert selection_geometry([[[-100.0, 30.0], [-98.0, 32.0], [-96.0, 34.0]]]) is None
+    assert selection_geometry([]) is None
+    assert len(query_sites_in_geometry(index, None)) == 0
+
+
+def test_positions_mask():
+    np.testing.assert_array_equal(positions_mask(5, np.array([1, 3])), [False, True, False, True, False])